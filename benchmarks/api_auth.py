@@ -0,0 +1,60 @@
+""" Measures API throughput with and without the credential cache.
+
+    Every request authenticates with HTTP Basic email and password, like
+    the scripted clients in api_queries.sh. Run from the repository root:
+
+        PYTHONPATH=src python benchmarks/api_auth.py --requests 50
+
+"""
+import argparse
+from base64 import b64encode
+import time
+
+from flasky.app import create_app, db
+from flasky.app.api.credentials import credential_cache
+from flasky.app.models import Role, User
+
+EMAIL = "bench@example.com"
+PASSWORD = "cat"
+
+
+def auth_headers():
+    credentials = b64encode(f"{EMAIL}:{PASSWORD}".encode("utf-8")).decode("utf-8")
+    return {"Authorization": "Basic " + credentials, "Accept": "application/json"}
+
+
+def requests_per_second(app, count):
+    client = app.test_client()
+    headers = auth_headers()
+    credential_cache.clear()
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.get("/api/v1/posts/", headers=headers)
+        assert response.status_code == 200
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        db.session.add(User(email=EMAIL, password=PASSWORD, confirmed=True))
+        db.session.commit()
+
+        app.config["FLASKY_API_CREDENTIAL_CACHE_TTL"] = 0
+        uncached = requests_per_second(app, args.requests)
+        app.config["FLASKY_API_CREDENTIAL_CACHE_TTL"] = 60
+        cached = requests_per_second(app, args.requests)
+
+    print(f"Without credential cache: {uncached:8.1f} requests/s")
+    print(f"With credential cache:    {cached:8.1f} requests/s")
+    print(f"Speedup:                  {cached / uncached:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
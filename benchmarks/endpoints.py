@@ -0,0 +1,260 @@
+""" Endpoint benchmarks against seeded databases of several sizes.
+
+    Seeds (or reuses) a SQLite database per scale, drives the main and
+    API routes through the Flask test client and writes latency
+    percentiles, query counts and peak memory per route to a JSON report.
+    When a baseline report is given, routes that issue more queries are
+    reported as regressions and the exit status is 1. Latency depends on
+    the machine and its load, so routes whose p50 grew by more than the
+    tolerance are only reported as warnings.
+
+    The POST and PUT routes write to the seeded database, so it grows a
+    little with every run. Delete benchmarks/data to start afresh.
+
+    Run from the repository root:
+
+        PYTHONPATH=src python benchmarks/endpoints.py --scale small
+        PYTHONPATH=src python benchmarks/endpoints.py --scale small \\
+            --baseline benchmarks/baseline-small.json
+
+"""
+import argparse
+from base64 import b64encode
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from sqlalchemy import event
+
+from flasky.app import create_app, db
+from flasky.app.fake import add_admin, seed_db
+from flasky.app.models import Comment, Post, User
+from flasky.config import config, TestingConfig
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+SCALES = {
+    "small": dict(users=100, posts=1000, follows=2000, comments=2000),
+    "medium": dict(users=5000, posts=100000, follows=200000, comments=200000),
+    "large": dict(users=50000, posts=1000000, follows=2000000, comments=2000000),
+}
+
+ADMIN_EMAIL = "john@example.com"
+ADMIN_PASSWORD = "cat"
+# Slowdowns smaller than this are treated as noise
+MIN_REGRESSION_MS = 1.0
+# Rows read by the multi-get routes and written by the batch routes
+BATCH_SIZE = 20
+
+
+def make_app(scale):
+    path = os.path.join(DATA_DIR, f"{scale}.sqlite")
+
+    class BenchmarkConfig(TestingConfig):
+        TESTING = False
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+        FLASKY_ADMIN = ADMIN_EMAIL
+
+    config["benchmark"] = BenchmarkConfig
+    app = create_app("benchmark")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f"Seeding {scale} database, this can take a while...")
+        with app.app_context():
+            db.create_all()
+            seed_db(**SCALES[scale])
+            add_admin()
+    return app
+
+
+def routes(app):
+    """ Returns (name, method, url, kind, body) tuples for every route. """
+    with app.app_context():
+        post = Post.query.order_by(Post.comment_count.desc()).first()
+        user = User.query.order_by(User.follower_count.desc()).first()
+        comment = Comment.query.first()
+        post_ids = ",".join(str(id_) for id_, in db.session.execute(
+            db.select(Post.id).order_by(Post.id.desc()).limit(BATCH_SIZE)))
+        comment_ids = ",".join(str(id_) for id_, in db.session.execute(
+            db.select(Comment.id).order_by(Comment.id.desc()).limit(BATCH_SIZE)))
+        user_ids = ",".join(str(id_) for id_, in db.session.execute(
+            db.select(User.id).order_by(User.id).limit(BATCH_SIZE)))
+        post_count = db.session.execute(
+            db.select(db.func.count()).select_from(Post)).scalar()
+    per_page = app.config["FLASKY_POSTS_PER_PAGE"]
+    last_page = max(1, post_count // per_page)
+    return [
+        ("main.index", "GET", "/", "web", None),
+        ("main.index deep page", "GET", f"/?page={last_page}", "web", None),
+        ("main.user", "GET", f"/user/{user.username}", "web", None),
+        ("main.post", "GET", f"/post/{post.id}", "web", None),
+        ("main.followers", "GET", f"/followers/{user.username}", "web", None),
+        ("main.followed_by", "GET", f"/followed_by/{user.username}", "web", None),
+        ("main.moderate", "GET", "/moderate", "web", None),
+        ("api.get_posts", "GET", "/api/v1/posts/", "api", None),
+        ("api.get_posts deep page", "GET", f"/api/v1/posts/?page={last_page}", "api", None),
+        ("api.get_posts cursor", "GET", "/api/v1/posts/?cursor=", "api", None),
+        ("api.get_post", "GET", f"/api/v1/posts/{post.id}", "api", None),
+        ("api.get_post_comments", "GET", f"/api/v1/posts/{post.id}/comments/", "api", None),
+        ("api.get_comments", "GET", "/api/v1/comments/", "api", None),
+        ("api.get_comment", "GET", f"/api/v1/comments/{comment.id}", "api", None),
+        ("api.get_user", "GET", f"/api/v1/users/{user.id}", "api", None),
+        ("api.get_user_posts", "GET", f"/api/v1/users/{user.id}/posts/", "api", None),
+        ("api.get_user_followed_posts", "GET", f"/api/v1/users/{user.id}/timeline/", "api", None),
+        ("api.get_posts ids", "GET", f"/api/v1/posts/?ids={post_ids}", "api", None),
+        ("api.get_comments ids", "GET", f"/api/v1/comments/?ids={comment_ids}", "api", None),
+        ("api.get_users ids", "GET", f"/api/v1/users/?ids={user_ids}", "api", None),
+        ("api.export posts", "GET", "/api/v1/export/posts", "api", None),
+        ("api.export comments", "GET", "/api/v1/export/comments", "api", None),
+        ("api.export follows", "GET", "/api/v1/export/follows", "api", None),
+        ("api.get_token", "POST", "/api/v1/tokens/", "api", None),
+        ("api.new_post", "POST", "/api/v1/posts/", "api", {"body": "benchmark *post*"}),
+        ("api.edit_post", "PUT", f"/api/v1/posts/{post.id}", "api", {"body": "edited *post*"}),
+        ("api.new_comment", "POST", f"/api/v1/posts/{post.id}/comments/", "api",
+         {"body": "benchmark comment"}),
+        ("api.new_posts", "POST", "/api/v1/posts/batch", "api",
+         {"posts": [{"body": f"benchmark *post* {ii}"} for ii in range(BATCH_SIZE)]}),
+        ("api.new_comments", "POST", "/api/v1/comments/batch", "api",
+         {"comments": [{"post_id": post.id, "body": f"benchmark comment {ii}"}
+                       for ii in range(BATCH_SIZE)]}),
+    ]
+
+
+def api_headers():
+    credentials = f"{ADMIN_EMAIL}:{ADMIN_PASSWORD}".encode("utf-8")
+    return {
+        "Authorization": "Basic " + b64encode(credentials).decode("utf-8"),
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(app, route, iterations, web_client, api_client):
+    name, method, url, kind, body = route
+    client = web_client if kind == "web" else api_client
+    kwargs = {"method": method}
+    if kind == "api":
+        kwargs["headers"] = api_headers()
+        if body is not None:
+            kwargs["data"] = json.dumps(body)
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    def request():
+        # Reading the body runs the generators of streamed responses
+        response = client.open(url, **kwargs)
+        response.get_data()
+        response.close()
+        return response
+
+    try:
+        # Warm up caches and connections once
+        response = request()
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name} returned {response.status_code}")
+        statements.clear()
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            request()
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries = len(statements) / iterations
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    tracemalloc.start()
+    request()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": percentile(latencies, 0.50),
+        "p90_ms": percentile(latencies, 0.90),
+        "p99_ms": percentile(latencies, 0.99),
+        "mean_ms": statistics.fmean(latencies),
+        "queries": queries,
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """ Returns the regressions and the slowdowns of report against
+        baseline. Only more queries count as a regression.
+    """
+    regressions = []
+    slowdowns = []
+    for name, result in report["routes"].items():
+        previous = baseline["routes"].get(name)
+        if previous is None:
+            continue
+        slowdown = result["p50_ms"] - previous["p50_ms"]
+        if (slowdown > MIN_REGRESSION_MS
+                and result["p50_ms"] > previous["p50_ms"] * (1 + tolerance)):
+            slowdowns.append(
+                f"{name}: p50 {previous['p50_ms']:.2f} ms -> {result['p50_ms']:.2f} ms")
+        if result["queries"] > previous["queries"]:
+            regressions.append(
+                f"{name}: queries {previous['queries']:.1f} -> {result['queries']:.1f}")
+    return regressions, slowdowns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", help="Where to write the JSON report.")
+    parser.add_argument("--baseline", help="Report to compare the results with.")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="p50 slowdown relative to the baseline that is "
+                             "reported as a warning.")
+    args = parser.parse_args()
+
+    app = make_app(args.scale)
+    web_client = app.test_client()
+    web_client.post("/auth/login", data={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+    web_client.set_cookie("localhost", "show_followed", "1")
+    api_client = app.test_client()
+
+    report = {"scale": args.scale, "iterations": args.iterations, "routes": {}}
+    for route in routes(app):
+        result = measure(app, route, args.iterations, web_client, api_client)
+        report["routes"][route[0]] = result
+        print(f"{route[0]:32} p50 {result['p50_ms']:8.2f} ms  "
+              f"p99 {result['p99_ms']:8.2f} ms  "
+              f"{result['queries']:5.1f} queries  "
+              f"{result['peak_memory_kb']:8.0f} KiB")
+
+    output = args.output or os.path.join(DATA_DIR, f"report-{args.scale}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"Report written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions, slowdowns = compare(report, json.load(baseline_file),
+                                             args.tolerance)
+        for slowdown in slowdowns:
+            print("WARNING slower", slowdown)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
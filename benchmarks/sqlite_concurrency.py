@@ -0,0 +1,141 @@
+""" Read throughput of the web views while a writer keeps committing.
+
+    Seeds a SQLite database once, then for each engine profile runs
+    reader threads that request random index and post pages next to a
+    writer thread that inserts posts, and reports reads and writes per
+    second, read latency and "database is locked" errors. The "default"
+    profile uses SQLite's defaults, "production" the pragmas and pool
+    options of ProductionConfig.
+
+    Run from the repository root:
+
+        PYTHONPATH=src python benchmarks/sqlite_concurrency.py --readers 4 --duration 5
+
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+
+from flasky.app import create_app, db
+from flasky.app.fake import seed_db
+from flasky.app.models import Post
+from flasky.config import config, ProductionConfig, TestingConfig
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SEED_PATH = os.path.join(DATA_DIR, "concurrency-seed.sqlite")
+
+
+def make_app(profile, path):
+    class BenchmarkConfig(TestingConfig):
+        TESTING = False
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+        FLASKY_LAST_SEEN_BUFFER = False
+
+    if profile == "production":
+        BenchmarkConfig.SQLALCHEMY_ENGINE_OPTIONS = ProductionConfig.SQLALCHEMY_ENGINE_OPTIONS
+        BenchmarkConfig.FLASKY_SQLITE_PRAGMAS = ProductionConfig.FLASKY_SQLITE_PRAGMAS
+    config["benchmark"] = BenchmarkConfig
+    return create_app("benchmark")
+
+
+def seed():
+    if os.path.exists(SEED_PATH):
+        return
+    os.makedirs(DATA_DIR, exist_ok=True)
+    app = make_app("default", SEED_PATH)
+    with app.app_context():
+        db.create_all()
+        seed_db(users=100, posts=2000, follows=1000, comments=2000, workers=1)
+        db.engine.dispose()
+
+
+def run(profile, readers, duration):
+    path = os.path.join(DATA_DIR, f"concurrency-{profile}.sqlite")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.copy(SEED_PATH, path)
+    app = make_app(profile, path)
+    with app.app_context():
+        posts = db.session.execute(db.select(db.func.count(Post.id))).scalar()
+    pages = posts // app.config["FLASKY_POSTS_PER_PAGE"]
+
+    stop = threading.Event()
+    latencies = []
+    counts = {"reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0}
+    lock = threading.Lock()
+
+    def reader(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        while not stop.is_set():
+            url = rng.choice([f"/?page={rng.randint(1, pages)}",
+                              f"/post/{rng.randint(1, posts)}"])
+            start = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 200:
+                    counts["reads"] += 1
+                    latencies.append(elapsed)
+                else:
+                    counts["read_errors"] += 1
+
+    def writer():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    db.session.add(Post(body="benchmark post", author_id=1))
+                    db.session.commit()
+                    key = "writes"
+                except OperationalError:
+                    db.session.rollback()
+                    key = "write_errors"
+                with lock:
+                    counts[key] += 1
+
+    threads = [threading.Thread(target=reader, args=(ii,)) for ii in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    with app.app_context():
+        db.engine.dispose()
+
+    latencies.sort()
+    return {
+        "reads_per_second": counts["reads"] / duration,
+        "writes_per_second": counts["writes"] / duration,
+        "read_p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "read_p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000 if latencies else None,
+        "read_errors": counts["read_errors"],
+        "write_errors": counts["write_errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--profile", choices=["default", "production"], action="append")
+    args = parser.parse_args()
+
+    seed()
+    for profile in args.profile or ["default", "production"]:
+        result = run(profile, args.readers, args.duration)
+        print(f"{profile:10}  {result['reads_per_second']:7.1f} reads/s  "
+              f"{result['writes_per_second']:7.1f} writes/s  "
+              f"p50 {result['read_p50_ms']:7.2f} ms  p95 {result['read_p95_ms']:7.2f} ms  "
+              f"errors {result['read_errors']}/{result['write_errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import os
+import click
 from flask_migrate import Migrate
 from flasky.app import create_app, db
-from flasky.app.models import Comment, User, Post, Role
+from flasky.app.models import Comment, User, Post, Role, Timeline, reconcile_counters
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 migrate = Migrate(app, db)
@@ -9,4 +10,81 @@ migrate = Migrate(app, db)
 
 @app.shell_context_processor
 def make_shell_context():
-    return dict(db=db, User=User, Role=Role, Post=Post, Comment=Comment)
+    return dict(db=db, User=User, Role=Role, Post=Post, Comment=Comment,
+                Timeline=Timeline)
+
+
+@app.cli.command("rebuild-timelines")
+def rebuild_timelines():
+    """ Rebuilds the materialized timelines from the follows table. """
+    Timeline.rebuild()
+    print("Timelines rebuilt")
+
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters_command():
+    """ Repairs the stored post, comment and follower counters. """
+    repaired = reconcile_counters()
+    print(f"Repaired counters on {repaired} rows")
+
+
+@app.cli.command()
+@click.option("--users", default=1000, help="Number of users.")
+@click.option("--posts", default=10000, help="Number of posts.")
+@click.option("--follows", default=50000, help="Approximate number of follows.")
+@click.option("--comments", default=20000, help="Number of comments.")
+@click.option("--workers", default=None, type=int,
+              help="Worker processes, defaults to the number of CPUs.")
+@click.option("--seed", default=0, help="Random seed.")
+def seed(users, posts, follows, comments, workers, seed):
+    """ Bulk inserts fake data. DO NOT use in production. """
+    from flasky.app.fake import seed_db
+    db.create_all()
+    seed_db(users, posts, follows, comments, workers, seed)
+
+
+@app.cli.command("slow-queries")
+@click.argument("path", required=False)
+@click.option("--limit", default=20, help="Number of statements to show.")
+def slow_queries(path, limit):
+    """ Summarizes the slow query log by normalized statement. """
+    from flasky.app.instrumentation import aggregate_slow_queries
+    path = path or app.config["FLASKY_SLOW_QUERY_LOG"]
+    if not path:
+        raise click.UsageError("No log file given and FLASKY_SLOW_QUERY_LOG is not set")
+    with open(path) as log_file:
+        groups = aggregate_slow_queries(log_file)
+    for group in groups[:limit]:
+        endpoints = ", ".join(f"{endpoint} ({count})"
+                              for endpoint, count in group["endpoints"].most_common(3))
+        print(f"{group['count']:6d} calls  {group['total']:9.3f} s total  "
+              f"{group['max']:7.3f} s max  {endpoints}")
+        print(f"    {group['statement']}")
+        for row in group["plan"] or []:
+            print(f"      {row[-1]}")
+
+
+@app.cli.command()
+@click.argument("name", type=click.Choice(["posts", "comments", "follows"]))
+@click.option("--updated-since", help="Only rows changed at or after this ISO 8601 time.")
+@click.option("--output", type=click.File("w"), default="-", help="Defaults to stdout.")
+def export(name, updated_since, output):
+    """ Writes a table as newline delimited JSON. """
+    from flasky.app.export import export_rows, ndjson, parse_since
+    rows = export_rows(name, parse_since(updated_since),
+                       app.config["FLASKY_EXPORT_BATCH_SIZE"])
+    output.writelines(ndjson(rows))
+
+
+@app.cli.command("render-bodies")
+@click.option("--workers", default=None, type=int,
+              help="Worker processes, defaults to the number of CPUs.")
+@click.option("--batch-size", default=1000, help="Rows read per query.")
+def render_bodies(workers, batch_size):
+    """ Renders the HTML of every post and comment again. Run after
+        changing the allowed tags.
+    """
+    from flasky.app.renderer import rerender
+    for model in (Post, Comment):
+        updated = rerender(model, workers, batch_size)
+        print(f"Updated {updated} {model.__tablename__}")
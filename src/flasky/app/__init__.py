@@ -6,14 +6,31 @@ from flask_login import LoginManager
 from flask_pagedown import PageDown
 from flask_sqlalchemy import SQLAlchemy
 from flasky.config import config
+from flasky.app.renderer import MarkdownRenderer
+from flasky.app.presence import LastSeenBuffer
+from flasky.app.email import MailQueue
+from flasky.app.instrumentation import SQLInstrumentation
+from flasky.app.metrics import Metrics
+from flasky.app.fragments import FragmentCache
+from flasky.app.pagecache import PageCache
+from flasky.app.sqlite import apply_pragmas
+from flasky.app.replicas import ReplicaRouter, RoutingSession
 
 bootstrap = Bootstrap()
 mail = Mail()
+mail_queue = MailQueue()
 moment = Moment()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+replica_router = ReplicaRouter()
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
 pagedown = PageDown()
+renderer = MarkdownRenderer()
+fragment_cache = FragmentCache()
+page_cache = PageCache()
+last_seen = LastSeenBuffer()
+sql_instrumentation = SQLInstrumentation()
+metrics = Metrics()
 
 
 def create_app(config_name):
@@ -23,10 +40,22 @@ def create_app(config_name):
 
     bootstrap.init_app(app)
     mail.init_app(app)
+    mail_queue.init_app(app)
     moment.init_app(app)
     db.init_app(app)
+    apply_pragmas(app)
+    replica_router.init_app(app)
+    sql_instrumentation.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    renderer.init_app(app)
+    fragment_cache.init_app(app)
+    page_cache.init_app(app)
+    last_seen.init_app(app)
+    metrics.init_app(app)
+    metrics.register_cache("render", renderer.stats)
+    metrics.register_cache("fragments", fragment_cache.stats)
+    metrics.register_cache("pages", page_cache.stats)
 
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
@@ -37,5 +66,8 @@ def create_app(config_name):
     from .api import api as api_blueprint
     app.register_blueprint(api_blueprint, url_prefix="/api/v1")
 
+    from .api.credentials import credential_cache
+    metrics.register_cache("api_credentials", credential_cache.stats)
+
     return app
 
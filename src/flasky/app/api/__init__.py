@@ -2,4 +2,4 @@ from flask import Blueprint
 
 api = Blueprint("api", __name__)
 
-from flasky.app.api import authentication, posts, users, comments, errors
+from flasky.app.api import authentication, posts, users, comments, errors, export
@@ -1,8 +1,9 @@
-from flask import g, jsonify
+from flask import current_app, g, jsonify
 from flask_httpauth import HTTPBasicAuth
 
 from flasky.app.models import User
 from flasky.app.api import api
+from flasky.app.api.credentials import credential_cache
 from flasky.app.api.errors import unauthorized, forbidden
 
 auth = HTTPBasicAuth()
@@ -21,7 +22,12 @@ def verify_password(email_or_token, password):
         return False
     g.current_user = user
     g.token_used = False
-    return user.verify_password(password)
+    if credential_cache.check(user, password):
+        return True
+    if user.verify_password(password):
+        credential_cache.add(user, password)
+        return True
+    return False
 
 
 @auth.error_handler
@@ -42,5 +48,5 @@ def get_token():
     if g.current_user.is_anonymous or g.token_used:
         return unauthorized("Invalid credentials")
     return jsonify({"token": g.current_user.generate_auth_token(),
-                    "expiration": 3600
+                    "expiration": current_app.config["FLASKY_API_TOKEN_EXPIRATION"]
                     })
@@ -0,0 +1,49 @@
+from flask import current_app, request
+
+from flasky.app.models import ValidationError
+
+
+def check_batch_size(count):
+    max_batch = current_app.config["FLASKY_API_MAX_BATCH"]
+    if count > max_batch:
+        raise ValidationError(f"At most {max_batch} items per request")
+
+
+def parse_ids(value):
+    """ Parses a comma separated ids argument, dropping repeated ids. """
+    try:
+        ids = [int(id_) for id_ in value.split(",") if id_.strip()]
+    except ValueError:
+        raise ValidationError("ids must be a comma separated list of integers")
+    if not ids:
+        raise ValidationError("No ids given")
+    ids = list(dict.fromkeys(ids))
+    check_batch_size(len(ids))
+    return ids
+
+
+def get_many(model, key):
+    """ Loads the rows listed in the ids argument with a single IN query.
+
+        Returns a dictionary with the JSON of the rows found, in the
+        requested order, under key and the ids that don't exist under
+        "missing".
+    """
+    ids = parse_ids(request.args["ids"])
+    rows = {row.id: row for row in model.query.filter(model.id.in_(ids))}
+    return {
+        key: [rows[id_].to_json() for id_ in ids if id_ in rows],
+        "missing": [id_ for id_ in ids if id_ not in rows],
+    }
+
+
+def batch_items(key):
+    """ Returns the list of items to create, sent either as a JSON array
+        or as an object holding the array under key.
+    """
+    data = request.get_json()
+    items = data.get(key) if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValidationError(f"Expected a list of {key}")
+    check_batch_size(len(items))
+    return items
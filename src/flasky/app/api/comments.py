@@ -1,25 +1,62 @@
-from flask import current_app, jsonify, request
+from flask import current_app, g, jsonify, request, url_for
 
+from flasky.app import db
 from flasky.app.api import api
-from flasky.app.api.paginate import paginate
-from flasky.app.models import Comment
+from flasky.app.api.batch import batch_items, get_many
+from flasky.app.api.decorators import permission_required
+from flasky.app.api.conditional import conditional_json, conditional_page
+from flasky.app.api.paginate import paginate_request
+from flasky.app.models import Comment, Permission, Post, ValidationError
 
 
 @api.route("/comments/")
 def get_comments():
-    page = request.args.get("page", 1, type=int)
-    comments, prev, next_page, total = paginate(
-        Comment.query, page, current_app.config["FLASKY_COMMENTS_PER_PAGE"], "api.get_comments"
-    )
-    return jsonify({
-        "comments": [c.to_json() for c in comments],
-        "prev": prev,
-        "next": next_page,
-        "count": total
-    })
+    if "ids" in request.args:
+        return jsonify(get_many(Comment, "comments"))
+
+    return conditional_page(paginate_request(
+        Comment.query, (Comment.timestamp, Comment.id),
+        current_app.config["FLASKY_COMMENTS_PER_PAGE"], "api.get_comments"
+    ), "comments")
 
 
 @api.route("/comments/<int:id>")
 def get_comment(id):
     comment = Comment.query.get_or_404(id)
-    return jsonify(comment.to_json())
+    return conditional_json(comment.to_json, (comment.id, comment.updated_at),
+                            comment.updated_at)
+
+
+@api.route("/comments/batch", methods=["POST"])
+@permission_required(Permission.COMMENT)
+def new_comments():
+    items = [item if isinstance(item, dict) else {} for item in batch_items("comments")]
+    post_ids = {item.get("post_id") for item in items}
+    existing = {id_ for id_, in db.session.execute(
+        db.select(Post.id).where(Post.id.in_([id_ for id_ in post_ids if isinstance(id_, int)]))
+    )}
+    results = []
+    created = []
+    for item in items:
+        if item.get("post_id") not in existing:
+            results.append({"status": 404, "error": "Post not found"})
+            continue
+        try:
+            comment = Comment.from_json(item)
+        except ValidationError as e:
+            results.append({"status": 400, "error": e.args[0]})
+            continue
+        comment.author_id = g.current_user.id
+        comment.post_id = item["post_id"]
+        db.session.add(comment)
+        created.append((len(results), comment))
+        results.append(None)
+    db.session.flush()
+    for index, comment in created:
+        results[index] = {
+            "status": 201,
+            "location": url_for("api.get_comment", id=comment.id),
+            "comment": comment.to_json(),
+        }
+    db.session.commit()
+    return jsonify({"results": results})
@@ -0,0 +1,63 @@
+import datetime
+import hashlib
+from flask import jsonify, make_response, request
+
+
+def make_etag(*version):
+    """ Returns a strong ETag for the requested URL at the given version. """
+    data = repr((request.full_path,) + version).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def _http_date(value):
+    """ Drops the microseconds HTTP dates can't hold and marks value as UTC. """
+    return value.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+
+
+def not_modified(etag, last_modified=None):
+    """ Returns True if the client's copy, as described by the request's
+        If-None-Match or If-Modified-Since header, is still current.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return _http_date(last_modified) <= request.if_modified_since
+    return False
+
+
+def conditional_json(make_payload, version, last_modified=None):
+    """ Returns make_payload() as JSON with an ETag for version, or an
+        empty 304 response if the client already has it, in which case
+        make_payload is never called.
+    """
+    etag = make_etag(*version)
+    if not_modified(etag, last_modified):
+        response = make_response("", 304)
+    else:
+        response = jsonify(make_payload())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _http_date(last_modified)
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional_page(page, key):
+    """ Returns a page from paginate_request as JSON under key.
+
+        The ETag is built from the id and updated_at of the rows on the
+        page and from its links and count, so answering 304 costs no more
+        than the page query itself.
+    """
+    items, prev, next_page, total = page
+    version = tuple((item.id, item.updated_at) for item in items) + \
+        (prev, next_page, total)
+
+    def payload():
+        return {
+            key: [item.to_json() for item in items],
+            "prev": prev,
+            "next": next_page,
+            "count": total
+        }
+    return conditional_json(payload, version)
@@ -0,0 +1,54 @@
+import hashlib
+import hmac
+import os
+import time
+from flask import current_app
+
+from flasky.app.cache import LRUCache
+
+
+class CredentialCache:
+    """ Short lived cache of successful email and password checks.
+
+        Entries are keyed by an HMAC of the credentials with a random
+        per-process key, so plaintext passwords are never stored. Each
+        entry remembers the user id and password hash it was verified
+        against: changing the password changes the hash and changing the
+        email changes the key, so both invalidate the entry.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.cache = LRUCache(max_entries=max_entries)
+        self._key = os.urandom(32)
+
+    def digest(self, email, password):
+        message = email.lower().encode("utf-8") + b"\0" + password.encode("utf-8")
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()
+
+    def check(self, user, password):
+        entry = self.cache.get(self.digest(user.email, password))
+        if entry is None:
+            return False
+        user_id, password_hash, expires = entry
+        if time.monotonic() >= expires:
+            self.cache.delete(self.digest(user.email, password))
+            return False
+        return user_id == user.id and hmac.compare_digest(password_hash, user.password_hash)
+
+    def add(self, user, password):
+        ttl = current_app.config["FLASKY_API_CREDENTIAL_CACHE_TTL"]
+        if ttl <= 0:
+            return
+        self.cache.set(
+            self.digest(user.email, password),
+            (user.id, user.password_hash, time.monotonic() + ttl)
+        )
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+credential_cache = CredentialCache()
@@ -9,6 +9,6 @@ def permission_required(permission):
         def decorated_function(*args, **kwargs):
             if not g.current_user.can(permission):
                 return forbidden("Insuficcient permissions")
-            return func(*args, *kwargs)
+            return func(*args, **kwargs)
         return decorated_function
     return decorator
@@ -0,0 +1,14 @@
+from flask import Response, current_app, request, stream_with_context
+
+from flasky.app.api import api
+from flasky.app.api.decorators import permission_required
+from flasky.app.export import export_rows, ndjson, parse_since
+from flasky.app.models import Permission
+
+
+@api.route("/export/<any(posts, comments, follows):name>")
+@permission_required(Permission.ADMIN)
+def export(name):
+    updated_since = parse_since(request.args.get("updated_since"))
+    rows = export_rows(name, updated_since, current_app.config["FLASKY_EXPORT_BATCH_SIZE"])
+    return Response(stream_with_context(ndjson(rows)), mimetype="application/x-ndjson")
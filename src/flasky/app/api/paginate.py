@@ -1,7 +1,13 @@
-from flask import url_for
+import datetime
+from flask import current_app, request, url_for
+from itsdangerous import URLSafeSerializer
+from itsdangerous.exc import BadSignature
 
+from flasky.app import db
+from flasky.app.models import ValidationError
 
-def paginate(query, page, per_page, url):
+
+def paginate(query, page, per_page, url, **kwargs):
     pagination = query.paginate(
         page=page,
         per_page=per_page,
@@ -11,7 +17,99 @@ def paginate(query, page, per_page, url):
     prev = None
     next_page = None
     if pagination.has_prev:
-        prev = url_for(url, page=page+1)
+        prev = url_for(url, page=page-1, **kwargs)
     if pagination.has_next:
-        next_page = url_for(url, page=page-1)
+        next_page = url_for(url, page=page+1, **kwargs)
     return items, prev, next_page, pagination.total
+
+
+def _cursor_serializer():
+    return URLSafeSerializer(current_app.config["SECRET_KEY"], salt="api-cursor")
+
+
+def encode_cursor(timestamp, id_, backwards=False):
+    return _cursor_serializer().dumps(
+        [timestamp.isoformat(), id_, "prev" if backwards else "next"]
+    )
+
+
+def decode_cursor(cursor):
+    """ Returns the (timestamp, id) position and direction of a cursor. """
+    try:
+        timestamp, id_, direction = _cursor_serializer().loads(cursor)
+        timestamp = datetime.datetime.fromisoformat(timestamp)
+    except (BadSignature, TypeError, ValueError):
+        raise ValidationError("Invalid cursor")
+    return (timestamp, id_), direction == "prev"
+
+
+def paginate_cursor(query, key, cursor, per_page, url,
+                    descending=False, count=False, **kwargs):
+    """ Keyset pagination over the (timestamp, id) columns in key.
+
+        Each page is a range scan that starts after the position stored
+        in the cursor, so deep pages cost the same as the first one.
+        The COUNT query only runs when count is True. Cursors are built
+        from the timestamp and id attributes of the returned items.
+    """
+    timestamp_column, id_column = key
+    position, backwards = None, False
+    if cursor:
+        position, backwards = decode_cursor(cursor)
+
+    # Going backwards scans the index in the opposite direction
+    scan_descending = descending != backwards
+    order = (timestamp_column.desc(), id_column.desc()) if scan_descending \
+        else (timestamp_column.asc(), id_column.asc())
+    page_query = query.order_by(None).order_by(*order)
+    if position is not None:
+        row = db.tuple_(timestamp_column, id_column)
+        bound = db.tuple_(*position)
+        page_query = page_query.filter(
+            row < bound if scan_descending else row > bound
+        )
+
+    rows = page_query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+
+    total = None
+    if count:
+        total = query.order_by(None).count()
+
+    prev = None
+    next_page = None
+    if items:
+        first, last = items[0], items[-1]
+        has_prev = has_more if backwards else position is not None
+        has_next = position is not None if backwards else has_more
+        if has_prev:
+            prev = url_for(url, cursor=encode_cursor(
+                first.timestamp, first.id, backwards=True), **kwargs)
+        if has_next:
+            next_page = url_for(url, cursor=encode_cursor(
+                last.timestamp, last.id), **kwargs)
+    return items, prev, next_page, total
+
+
+def paginate_request(query, key, per_page, url, descending=False, **kwargs):
+    """ Paginates query with the mode requested by the client.
+
+        Requests with a ``cursor`` argument (empty for the first page) use
+        keyset pagination and skip the total count unless ``count=true``
+        is given. Everything else keeps the ``page`` based pagination.
+    """
+    cursor = request.args.get("cursor")
+    if cursor is not None:
+        count = request.args.get("count", "false").lower() in ["true", "on", "1"]
+        return paginate_cursor(query, key, cursor, per_page, url,
+                               descending=descending, count=count, **kwargs)
+    page = request.args.get("page", 1, type=int)
+    timestamp_column, id_column = key
+    if descending:
+        order = (timestamp_column.desc(), id_column.desc())
+    else:
+        order = (timestamp_column.asc(), id_column.asc())
+    return paginate(query.order_by(None).order_by(*order), page, per_page, url, **kwargs)
@@ -1,38 +1,37 @@
 from flask import current_app, g, jsonify, request, url_for
 
 from flasky.app import db
-from flasky.app.models import Comment, Post, Permission
+from flasky.app.models import Comment, Post, Permission, ValidationError
 from flasky.app.api import api
+from flasky.app.api.batch import batch_items, get_many
+from flasky.app.api.conditional import conditional_json, conditional_page
 from flasky.app.api.errors import forbidden
 from flasky.app.api.decorators import permission_required
-from flasky.app.api.paginate import paginate
+from flasky.app.api.paginate import paginate_request
 
 
 @api.route("/posts/")
 def get_posts():
-    page = request.args.get("page", 1, type=int)
-    posts, prev, next_page, total = paginate(
-        Post.query, page, current_app.config["FLASKY_POSTS_PER_PAGE"], "api.get_posts"
-    )
-    return jsonify({
-        "posts": [p.to_json() for p in posts],
-        "prev": prev,
-        "next": next_page,
-        "count": total
-    })
+    if "ids" in request.args:
+        return jsonify(get_many(Post, "posts"))
+
+    return conditional_page(paginate_request(
+        Post.query, (Post.timestamp, Post.id),
+        current_app.config["FLASKY_POSTS_PER_PAGE"], "api.get_posts"
+    ), "posts")
 
 
 @api.route("/posts/<int:id>")
 def get_post(id):
     post = Post.query.get_or_404(id)
-    return jsonify(post.to_json())
+    return conditional_json(post.to_json, (post.id, post.updated_at), post.updated_at)
 
 
 @api.route("/posts/", methods=["POST"])
 @permission_required(Permission.WRITE_ARTICLES)
 def new_post():
     post = Post.from_json(request.json)
-    post.author = g.current_user
+    post.author_id = g.current_user.id
     db.session.add(post)
     db.session.commit()
     return (
@@ -41,11 +40,39 @@ def new_post():
     )
 
 
+@api.route("/posts/batch", methods=["POST"])
+@permission_required(Permission.WRITE_ARTICLES)
+def new_posts():
+    results = []
+    created = []
+    for item in batch_items("posts"):
+        try:
+            post = Post.from_json(item if isinstance(item, dict) else {})
+        except ValidationError as e:
+            results.append({"status": 400, "error": e.args[0]})
+            continue
+        post.author_id = g.current_user.id
+        db.session.add(post)
+        created.append((len(results), post))
+        results.append(None)
+    # Flushing assigns the ids, so the results can be built before the
+    # commit expires the new posts
+    db.session.flush()
+    for index, post in created:
+        results[index] = {
+            "status": 201,
+            "location": url_for("api.get_post", id=post.id),
+            "post": post.to_json(),
+        }
+    db.session.commit()
+    return jsonify({"results": results})
+
+
 @api.route("/posts/<int:id>", methods=["PUT"])
 @permission_required(Permission.WRITE_ARTICLES)
 def edit_post(id):
     post = Post.query.get_or_404(id)
-    if g.current_user != post.author and \
+    if g.current_user.id != post.author_id and \
             not g.current_user.can(Permission.ADMIN):
         return forbidden("Insufficent permissions")
     post.body = request.json.get("body", "")
@@ -57,17 +84,10 @@ def edit_post(id):
 @api.route("/posts/<int:id>/comments/")
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
-    comments, prev, next_page, total = paginate(
-        post.comments.order_by(Comment.timestamp.asc()),
-        page, current_app.config["FLASKY_COMMENTS_PER_PAGE"], "api.get_comments"
-    )
-    return jsonify({
-        "comments": [c.to_json() for c in comments],
-        "prev": prev,
-        "next": next_page,
-        "count": total
-    })
+    return conditional_page(paginate_request(
+        post.comments, (Comment.timestamp, Comment.id),
+        current_app.config["FLASKY_COMMENTS_PER_PAGE"], "api.get_post_comments", id=id
+    ), "comments")
 
 
 @api.route("/posts/<int:id>/comments/", methods=["POST"])
@@ -1,43 +1,38 @@
 from flask import current_app, jsonify, request
 
-from flasky.app.models import User, Post
+from flasky.app.models import User, Post, ValidationError
 from flasky.app.api import api
-from flasky.app.api.paginate import paginate
+from flasky.app.api.batch import get_many
+from flasky.app.api.conditional import conditional_json, conditional_page
+from flasky.app.api.paginate import paginate_request
+
+
+@api.route("/users/")
+def get_users():
+    if "ids" not in request.args:
+        raise ValidationError("Users can only be listed by ids")
+    return jsonify(get_many(User, "users"))
 
 
 @api.route("/users/<int:id>")
 def get_user(id):
     user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    return conditional_json(user.to_json, (user.id, user.updated_at), user.updated_at)
 
 
 @api.route("/users/<int:id>/posts/")
 def get_user_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
-    posts, prev, next_page, total = paginate(
-        user.posts.order_by(Post.timestamp.asc()),
-        page, current_app.config["FLASKY_POSTS_PER_PAGE"], "api.get_posts"
-    )
-    return jsonify({
-        "posts": [p.to_json() for p in posts],
-        "prev": prev,
-        "next": next_page,
-        "count": total
-    })
+    return conditional_page(paginate_request(
+        user.posts, (Post.timestamp, Post.id),
+        current_app.config["FLASKY_POSTS_PER_PAGE"], "api.get_user_posts", id=id
+    ), "posts")
 
 
 @api.route("/users/<int:id>/timeline/")
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get("page", 1, type=int)
-    posts, prev, next_page, total = paginate(
-        user.followed_posts.order_by(Post.timestamp.asc()),
-        page, current_app.config["FLASKY_POSTS_PER_PAGE"], "api.get_posts"
-    )
-    return jsonify({
-        "posts": [p.to_json() for p in posts],
-        "prev": prev,
-        "next": next_page,
-        "count": total
-    })
+    return conditional_page(paginate_request(
+        user.followed_posts, user.followed_posts_key(),
+        current_app.config["FLASKY_POSTS_PER_PAGE"], "api.get_user_followed_posts", id=id
+    ), "posts")
@@ -1,31 +1,15 @@
 from flask import current_app, render_template, redirect, request, url_for, flash
 from flask_login import current_user, login_user, login_required, logout_user
-from flask_mail import Message
-from threading import Thread
 
-from flasky.app import db, mail
+from flasky.app import db, last_seen
+from flasky.app.email import send_email
 from flasky.app.models import User
 from flasky.app.auth import auth
+from flasky.app.replicas import use_primary
 from flasky.app.auth.forms import LoginForm, RegistrationForm, ChangePasswordForm, \
     PasswordResetRequestForm, PasswordResetForm, ChangeEmailForm
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
-
-
-def send_email(to, subject, template, **kwargs):
-    app = current_app._get_current_object()
-    msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
-
-
 @auth.route("/login", methods=["GET", "POST"])
 def login():
     form = LoginForm()
@@ -73,6 +57,7 @@ def register():
 
 
 @auth.route("/confirm/<token>")
+@use_primary
 @login_required
 def confirm(token):
     if current_user.confirmed:
@@ -87,12 +72,17 @@ def confirm(token):
 
 @auth.before_app_request
 def before_request():
+    # Static files and avatars don't depend on the user, skip loading it
+    if request.endpoint in ("static", "main.avatar"):
+        return
     if current_user.is_authenticated:
-        current_user.ping()
+        if current_app.config["FLASKY_LAST_SEEN_BUFFER"]:
+            last_seen.ping(current_user)
+        else:
+            current_user.ping()
         if not current_user.confirmed \
                 and request.endpoint \
-                and request.blueprint != "auth" \
-                and request.endpoint != "static":
+                and request.blueprint != "auth":
             return redirect(url_for("auth.unconfirmed"))
 
 
@@ -180,6 +170,7 @@ def change_email_request():
 
 
 @auth.route("/change_email/<token>")
+@use_primary
 @login_required
 def change_email(token):
     if current_user.change_email(token):
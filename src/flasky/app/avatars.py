@@ -0,0 +1,91 @@
+import colorsys
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+from flask import current_app
+
+# Bump when the drawing changes, so cached images are regenerated
+IDENTICON_VERSION = 1
+GRID = 5
+# The only sizes served, so each hash has a handful of cached images
+SIZES = (16, 32, 40, 64, 80, 128, 256, 512)
+
+
+def _png_chunk(kind, data):
+    chunk = kind + data
+    return struct.pack(">I", len(data)) + chunk + \
+        struct.pack(">I", zlib.crc32(chunk) & 0xffffffff)
+
+
+def _png(width, height, rows):
+    """ Encodes rows of RGB bytes as a PNG image. """
+    raw = b"".join(b"\x00" + row for row in rows)
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)),
+        _png_chunk(b"IDAT", zlib.compress(raw, 9)),
+        _png_chunk(b"IEND", b""),
+    ])
+
+
+def identicon(avatar_hash, size):
+    """ Draws a symmetric 5x5 identicon for an MD5 hex digest.
+
+        The first 15 bits of the hash fill the left half and middle
+        column of the grid, which is mirrored to the right. The last
+        bytes pick the hue of the foreground.
+    """
+    digest = bytes.fromhex(avatar_hash)
+    bits = int.from_bytes(digest[:2], "big")
+    half = (GRID + 1) // 2
+    cells = [[False] * GRID for _ in range(GRID)]
+    for index in range(GRID * half):
+        row, column = divmod(index, half)
+        cells[row][column] = cells[row][GRID - 1 - column] = bool(bits >> index & 1)
+
+    hue = int.from_bytes(digest[-2:], "big") / 0xffff
+    red, green, blue = colorsys.hls_to_rgb(hue, 0.55, 0.6)
+    foreground = bytes([int(red * 255), int(green * 255), int(blue * 255)])
+    background = b"\xf0\xf0\xf0"
+
+    columns = [x * GRID // size for x in range(size)]
+    patterns = [b"".join(foreground if cells[row][column] else background
+                         for column in columns) for row in range(GRID)]
+    rows = [patterns[y * GRID // size] for y in range(size)]
+    return _png(size, size, rows)
+
+
+def snap_size(size):
+    """ Returns the supported size nearest to size. """
+    return min(SIZES, key=lambda candidate: abs(candidate - size))
+
+
+def _cache_path(avatar_hash, size):
+    # Named after a digest of everything that determines the content, so
+    # an existing file never needs invalidating
+    name = hashlib.sha256(
+        f"{avatar_hash}:{size}:{IDENTICON_VERSION}".encode("utf-8")).hexdigest()
+    directory = os.path.join(current_app.config["FLASKY_AVATAR_CACHE_DIR"], name[:2])
+    return directory, os.path.join(directory, name + ".png")
+
+
+def cached_avatar_path(avatar_hash, size):
+    """ Returns the path of the cached identicon, or None if it isn't cached. """
+    _, path = _cache_path(avatar_hash, size)
+    return path if os.path.exists(path) else None
+
+
+def avatar_path(avatar_hash, size):
+    """ Returns the path of the cached identicon, generating it if needed. """
+    directory, path = _cache_path(avatar_hash, size)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first, so concurrent requests never
+        # serve a partly written image
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(identicon(avatar_hash, size))
+        os.replace(tmp_path, path)
+    return path
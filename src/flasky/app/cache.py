@@ -0,0 +1,86 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """ Thread safe least recently used cache.
+
+        The cache is bounded both by number of entries and by the
+        approximate size of the stored values, as returned by sizeof.
+    """
+
+    def __init__(self, max_entries=1024, max_size=None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.size -= self._data.pop(key)[1]
+            if self.max_size is not None and size > self.max_size:
+                return
+            self._data[key] = (value, size)
+            self.size += size
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self.size -= value[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def resize(self, max_entries, max_size=None):
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_size = max_size
+            self._evict()
+
+    def _evict(self):
+        while self._data and (
+                len(self._data) > self.max_entries or
+                (self.max_size is not None and self.size > self.max_size)):
+            _, (_, size) = self._data.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
@@ -0,0 +1,195 @@
+import atexit
+import logging
+import queue
+import smtplib
+import threading
+import time
+from flask import current_app, render_template
+from flask_mail import BadHeaderError, Message
+
+logger = logging.getLogger(__name__)
+
+# Errors that will fail again no matter how many times the message is sent
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                    BadHeaderError, AssertionError)
+
+
+class MailQueue:
+    """ Delivers email from a fixed pool of worker threads.
+
+        Messages wait in a bounded queue. Each worker takes up to
+        FLASKY_MAIL_BATCH_SIZE queued messages and sends them over one
+        SMTP connection. Messages that fail with a transient error are
+        retried FLASKY_MAIL_RETRIES times with exponential backoff.
+
+        At exit the queue is given FLASKY_MAIL_SHUTDOWN_TIMEOUT seconds to
+        drain, so queued confirmation and reset emails aren't lost.
+    """
+
+    def __init__(self, app=None):
+        self.workers = 2
+        self.batch_size = 20
+        self.retries = 3
+        self.backoff = 1.0
+        self.shutdown_timeout = 10
+        self._at_exit = False
+        self._queue = queue.Queue(maxsize=100)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retried = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.workers = app.config["FLASKY_MAIL_WORKERS"]
+        self.batch_size = app.config["FLASKY_MAIL_BATCH_SIZE"]
+        self.retries = app.config["FLASKY_MAIL_RETRIES"]
+        self.backoff = app.config["FLASKY_MAIL_RETRY_BACKOFF"]
+        self.shutdown_timeout = app.config["FLASKY_MAIL_SHUTDOWN_TIMEOUT"]
+        with self._lock:
+            if not self._threads:
+                self._queue = queue.Queue(maxsize=app.config["FLASKY_MAIL_QUEUE_SIZE"])
+        app.extensions["mail_queue"] = self
+
+    def enqueue(self, msg):
+        """ Queues msg for delivery. Returns False if the queue is full. """
+        self._start()
+        app = current_app._get_current_object()
+        try:
+            self._queue.put_nowait((app, msg, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.error("Mail queue full, dropping message to %s", msg.recipients)
+            return False
+        return True
+
+    def join(self, timeout=None):
+        """ Blocks until every queued message has been handled, or until
+            timeout seconds have passed. Returns True if the queue drained.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self):
+        """ Waits for the queued messages before the process exits. """
+        if not self.join(self.shutdown_timeout):
+            logger.error("Exiting with %d undelivered messages", self._queue.unfinished_tasks)
+
+    def _start(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True,
+                                          name=f"mail-worker-{len(self._threads)}")
+                thread.start()
+                self._threads.append(thread)
+            if not self._at_exit:
+                atexit.register(self.close)
+                self._at_exit = True
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                by_app = {}
+                for app, msg, queued_at in batch:
+                    by_app.setdefault(app, []).append((msg, queued_at))
+                for app, messages in by_app.items():
+                    with app.app_context():
+                        self.deliver(messages)
+            except Exception:
+                logger.exception("Mail worker failed to deliver a batch")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def deliver(self, messages):
+        """ Sends a list of (message, queued_at) pairs, reusing one SMTP
+            connection per attempt. Returns the number of messages sent.
+        """
+        pending = list(messages)
+        sent = 0
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retried += len(pending)
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            pending, delivered = self._send_batch(pending)
+            sent += delivered
+            if not pending:
+                break
+        if pending:
+            with self._lock:
+                self.failed += len(pending)
+            logger.error("Giving up on %d messages after %d retries",
+                         len(pending), self.retries)
+        return sent
+
+    def _send_batch(self, messages):
+        """ Returns the messages that should be retried and the number sent. """
+        handled = 0
+        sent = 0
+        try:
+            with current_app.extensions["mail"].connect() as connection:
+                for msg, queued_at in messages:
+                    try:
+                        connection.send(msg)
+                    except PERMANENT_ERRORS:
+                        logger.exception("Failed to send message to %s", msg.recipients)
+                        with self._lock:
+                            self.failed += 1
+                    else:
+                        sent += 1
+                        self._record_delivery(queued_at)
+                    handled += 1
+        except (smtplib.SMTPException, OSError):
+            # The connection is broken, the rest is retried on a new one
+            logger.warning("SMTP delivery failed", exc_info=True)
+        return messages[handled:], sent
+
+    def _record_delivery(self, queued_at):
+        latency = time.monotonic() - queued_at
+        with self._lock:
+            self.sent += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "workers": len(self._threads),
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "retried": self.retried,
+                "latency_total": self.latency_total,
+                "latency_avg": self.latency_total / self.sent if self.sent else 0.0,
+                "latency_max": self.latency_max,
+            }
+
+
+def send_email(to, subject, template, **kwargs):
+    app = current_app._get_current_object()
+    msg = Message(app.config['FLASKY_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
+                  sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
+    msg.body = render_template(template + '.txt', **kwargs)
+    msg.html = render_template(template + '.html', **kwargs)
+    return app.extensions["mail_queue"].enqueue(msg)
@@ -0,0 +1,73 @@
+import datetime
+import json
+
+from flasky.app import db
+from flasky.app.models import Comment, Follow, Post, ValidationError
+
+# Exported tables: the model, its exported columns and the column used by
+# the updated_since filter
+EXPORTS = {
+    "posts": (Post, ("id", "body", "body_html", "timestamp", "author_id",
+                     "comment_count", "updated_at"), "updated_at"),
+    "comments": (Comment, ("id", "body", "body_html", "timestamp", "disabled",
+                           "author_id", "post_id", "updated_at"), "updated_at"),
+    "follows": (Follow, ("follower_id", "followed_id", "timestamp"), "timestamp"),
+}
+
+
+def parse_since(value):
+    """ Parses an ISO 8601 updated_since value into a naive UTC datetime. """
+    if not value:
+        return None
+    try:
+        since = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f"Invalid updated_since: {value}")
+    if since.tzinfo is not None:
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return since
+
+
+def export_rows(name, updated_since=None, batch_size=1000):
+    """ Yields every row of an exported table as a dictionary.
+
+        Rows are read in primary key order, one batch per query, starting
+        after the last key of the previous batch. Only one batch of plain
+        Core rows is held at a time, so memory use doesn't grow with the
+        size of the table.
+    """
+    model, columns, since_column = EXPORTS[name]
+    table = model.__table__
+    keys = list(table.primary_key.columns)
+    key = keys[0] if len(keys) == 1 else db.tuple_(*keys)
+    query = db.select(*(table.c[column] for column in columns)).order_by(*keys)
+    if updated_since is not None:
+        query = query.where(table.c[since_column] >= updated_since)
+
+    last = None
+    while True:
+        batch_query = query.limit(batch_size)
+        if last is not None:
+            batch_query = batch_query.where(key > last)
+        rows = db.session.execute(batch_query).mappings().all()
+        # End the read transaction between batches, so a long export
+        # doesn't hold SQLite's shared lock and block writers
+        db.session.rollback()
+        for row in rows:
+            yield dict(row)
+        if len(rows) < batch_size:
+            break
+        last = rows[-1][keys[0].key] if len(keys) == 1 else \
+            db.tuple_(*(rows[-1][column.key] for column in keys))
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat() + "Z"
+    raise TypeError(f"Can't serialize {type(value).__name__}")
+
+
+def ndjson(rows):
+    """ Yields one JSON document per row, each ending in a newline. """
+    for row in rows:
+        yield json.dumps(row, default=_default) + "\n"
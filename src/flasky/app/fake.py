@@ -1,8 +1,23 @@
-from random import randint
-from sqlalchemy.exc import IntegrityError
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
+import itertools
+import os
+import random
 from faker import Faker
+from werkzeug.security import generate_password_hash
 from flasky.app import create_app, db
-from flasky.app.models import User, Post, Role
+from flasky.app.models import Comment, Follow, Post, Role, Timeline, User, \
+    reconcile_counters
+from flasky.app.renderer import COMMENT_TAGS, POST_TAGS, render_markdown
+
+CHUNK_SIZE = 5000
+# Exponent of the Zipf distribution used to pick popular users and posts
+ZIPF_EXPONENT = 1.1
+
+# Ids of the existing rows, by table name, that the row generators pick
+# from. Set by _run in this process and in every worker
+_existing_ids = {}
 
 
 def clear_db(app):
@@ -12,36 +27,209 @@ def clear_db(app):
         db.session.remove()
 
 
-def add_users(count=100):
-    fake = Faker()
-    ii = 0
-    while ii < count:
-        user = User(
-            email=fake.email(),
-            username=fake.user_name(),
-            password="password",
-            confirmed=True,
-            name=fake.name(),
-            location=fake.city(),
-            about_me=fake.text(),
-            member_since=fake.past_date()
-        )
-        db.session.add(user)
-        try:
+def _chunks(first_id, count, size=CHUNK_SIZE):
+    for offset in range(0, count, size):
+        yield first_id + offset, min(size, count - offset)
+
+
+def _share_ids(ids):
+    _existing_ids.clear()
+    _existing_ids.update(ids)
+    _popularity.cache_clear()
+
+
+def _run(func, tasks, workers, ids=None):
+    """ Maps func over tasks in a process pool, yielding results in order.
+        ids are sent once to each worker, not with every task.
+    """
+    ids = ids or {}
+    if workers <= 1:
+        _share_ids(ids)
+        yield from map(func, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_share_ids,
+                             initargs=(ids,)) as executor:
+        yield from executor.map(func, tasks)
+
+
+def _insert(model, chunks):
+    """ Inserts chunks of row dictionaries with executemany. Bypasses the
+        ORM, so mapper events don't run for these rows.
+    """
+    total = 0
+    for rows in chunks:
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
             db.session.commit()
-            ii += 1
-        except IntegrityError:
-            db.session.rollback()
+            total += len(rows)
+    return total
 
 
-def add_posts(count=100):
+def _max_id(model):
+    return db.session.execute(db.select(db.func.max(model.id))).scalar() or 0
+
+
+def _ids(model):
+    """ Returns the ids of model's rows. Deleted rows leave gaps, so the
+        ids can't be taken from the range 1..max id.
+    """
+    return db.session.execute(db.select(model.id).order_by(model.id)).scalars().all()
+
+
+@lru_cache(maxsize=4)
+def _popularity(table, seed):
+    """ Returns the existing ids of table shuffled, and cumulative Zipf
+        weights, so that a few randomly chosen ids receive most of the picks.
+    """
+    ids = list(_existing_ids[table])
+    random.Random(seed).shuffle(ids)
+    weights = (1 / rank ** ZIPF_EXPONENT for rank in range(1, len(ids) + 1))
+    return ids, list(itertools.accumulate(weights))
+
+
+def _user_rows(task):
+    first_id, count, password_hash, role_id, seed = task
     fake = Faker()
-    user_count = User.query.count()
-    for ii in range(count):
-        user = User.query.offset(randint(0, user_count - 1)).first()
-        post = Post(body=fake.text(), timestamp=fake.past_date(), author=user)
-        db.session.add(post)
-    db.session.commit()
+    fake.seed_instance(seed + first_id)
+    rows = []
+    for id_ in range(first_id, first_id + count):
+        # The id suffix keeps emails and usernames unique without retries
+        username = f"{fake.user_name()}{id_}"
+        email = f"{username}@{fake.free_email_domain()}"
+        member_since = fake.date_time_between(start_date="-3y")
+        rows.append({
+            "id": id_,
+            "email": email,
+            "username": username,
+            "password_hash": password_hash,
+            "role_id": role_id,
+            "confirmed": True,
+            "name": fake.name(),
+            "location": fake.city(),
+            "about_me": fake.text(),
+            "member_since": member_since,
+            "last_seen": fake.date_time_between(start_date=member_since),
+            "avatar_hash": hashlib.md5(email.encode("utf-8")).hexdigest(),
+        })
+    return rows
+
+
+def _post_rows(task):
+    first_id, count, seed = task
+    fake = Faker()
+    fake.seed_instance(seed + first_id)
+    rng = random.Random(seed + first_id)
+    authors, weights = _popularity("users", seed)
+    rows = []
+    for id_, author_id in zip(range(first_id, first_id + count),
+                              rng.choices(authors, cum_weights=weights, k=count)):
+        body = fake.text()
+        rows.append({
+            "id": id_,
+            "body": body,
+            "body_html": render_markdown(body, POST_TAGS),
+            "timestamp": fake.date_time_between(start_date="-2y"),
+            "author_id": author_id,
+        })
+    return rows
+
+
+def _follow_rows(task):
+    follower_ids, average, seed = task
+    rng = random.Random(seed + follower_ids[0])
+    users, weights = _popularity("users", seed)
+    # Pareto distributed out-degree with the requested mean (alpha = 2)
+    scale = average / 2
+    rows = []
+    for follower_id in follower_ids:
+        degree = min(len(users) - 1, int(rng.paretovariate(2) * scale))
+        followed = {follower_id}
+        # Popular users get picked repeatedly, so top up a few times
+        for _ in range(3):
+            missing = degree + 1 - len(followed)
+            if missing <= 0:
+                break
+            followed.update(rng.choices(users, cum_weights=weights, k=missing))
+        rows.extend({"follower_id": follower_id, "followed_id": followed_id}
+                    for followed_id in followed)
+    return rows
+
+
+def _comment_rows(task):
+    first_id, count, seed = task
+    fake = Faker()
+    fake.seed_instance(seed + first_id)
+    rng = random.Random(seed + first_id)
+    authors, author_weights = _popularity("users", seed)
+    posts, post_weights = _popularity("posts", seed + 2)
+    rows = []
+    for id_, author_id, post_id in zip(
+            range(first_id, first_id + count),
+            rng.choices(authors, cum_weights=author_weights, k=count),
+            rng.choices(posts, cum_weights=post_weights, k=count)):
+        body = fake.sentence()
+        rows.append({
+            "id": id_,
+            "body": body,
+            "body_html": render_markdown(body, COMMENT_TAGS),
+            "timestamp": fake.date_time_between(start_date="-2y"),
+            "disabled": False,
+            "author_id": author_id,
+            "post_id": post_id,
+        })
+    return rows
+
+
+def add_users(count=100, workers=1, seed=0, password="password"):
+    """ Bulk inserts count users. The password is hashed only once. """
+    password_hash = generate_password_hash(password)
+    role_id = Role.query.filter_by(default=True).first().id
+    tasks = ((first_id, size, password_hash, role_id, seed)
+             for first_id, size in _chunks(_max_id(User) + 1, count))
+    return _insert(User, _run(_user_rows, tasks, workers))
+
+
+def add_posts(count=100, workers=1, seed=0):
+    """ Bulk inserts count posts. A few users write most of them. """
+    users = _ids(User)
+    if not users:
+        return 0
+    tasks = ((first_id, size, seed)
+             for first_id, size in _chunks(_max_id(Post) + 1, count))
+    return _insert(Post, _run(_post_rows, tasks, workers, {"users": users}))
+
+
+def add_followers(count=1000, workers=1, seed=0):
+    """ Generates a power law follow graph with about count follows for
+        the users that don't follow anyone yet.
+
+        Every user also follows itself, as User.__init__ does.
+    """
+    users = _ids(User)
+    new_users = db.session.execute(
+        db.select(User.id)
+        .where(User.id.not_in(db.select(Follow.follower_id)))
+        .order_by(User.id)
+    ).scalars().all()
+    if not new_users:
+        return 0
+    average = count / len(new_users)
+    size = CHUNK_SIZE // 10
+    tasks = ((new_users[offset:offset + size], average, seed)
+             for offset in range(0, len(new_users), size))
+    return _insert(Follow, _run(_follow_rows, tasks, workers, {"users": users}))
+
+
+def add_comments(count=1000, workers=1, seed=0):
+    """ Bulk inserts count comments, concentrated on popular posts. """
+    users = _ids(User)
+    posts = _ids(Post)
+    if not users or not posts:
+        return 0
+    tasks = ((first_id, size, seed)
+             for first_id, size in _chunks(_max_id(Comment) + 1, count))
+    return _insert(Comment, _run(_comment_rows, tasks, workers,
+                                 {"users": users, "posts": posts}))
 
 
 def add_admin():
@@ -58,12 +246,28 @@ def add_admin():
     db.session.commit()
 
 
-def add_followers():
-    pass
-
+def seed_db(users=100, posts=100, follows=1000, comments=1000,
+            workers=None, seed=0):
+    """ Fills an empty database with fake data using bulk inserts.
 
-def add_comments():
-    pass
+        Faker generation and Markdown rendering run in a pool of worker
+        processes. Counters and timelines are rebuilt at the end, since
+        the bulk inserts skip the events that maintain them.
+    """
+    workers = workers or os.cpu_count()
+    Role.insert_roles()
+    added = add_users(users, workers, seed)
+    print(f"Added {added} users")
+    added = add_posts(posts, workers, seed)
+    print(f"Added {added} posts")
+    added = add_followers(follows, workers, seed)
+    print(f"Added {added} follows")
+    added = add_comments(comments, workers, seed)
+    print(f"Added {added} comments")
+    reconcile_counters()
+    if Timeline.enabled():
+        Timeline.rebuild()
+    print("Rebuilt counters")
 
 
 def main():
@@ -80,13 +284,7 @@ def main():
 
     with app.app_context():
         db.create_all()
-        Role.insert_roles()
-
-        add_users(100)
-        print("Finished adding users")
-        add_posts(100)
-        print("Finished adding posts")
-
+        seed_db()
         add_admin()
 
     print("DONE")
@@ -0,0 +1,50 @@
+from flask import request
+from markupsafe import Markup
+
+from flasky.app.cache import LRUCache
+
+
+class FragmentCache:
+    """ Caches rendered template fragments in a bounded LRU cache.
+
+        Templates wrap the parts of a page that are the same for every
+        viewer in a call block:
+
+            {% call cache_fragment("post", post.id, post.updated_at) %}
+                ...
+            {% endcall %}
+
+        The key arguments must include a version, such as updated_at, so
+        that editing a row renders a new fragment and the stale one ages
+        out of the cache. The URL root of the request is added to every
+        key since gravatar URLs depend on the scheme and links on the
+        script root.
+    """
+
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config["FLASKY_FRAGMENT_CACHE"]
+        self.cache.resize(app.config["FLASKY_FRAGMENT_CACHE_ENTRIES"],
+                          app.config["FLASKY_FRAGMENT_CACHE_MAX_SIZE"])
+        app.jinja_env.globals["cache_fragment"] = self.fragment
+
+    def fragment(self, *key, caller):
+        if not self.enabled:
+            return caller()
+        key = repr((request.url_root,) + key)
+        html = self.cache.get(key)
+        if html is None:
+            html = str(caller())
+            self.cache.set(key, html)
+        return Markup(html)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,216 @@
+from collections import Counter
+import json
+import logging
+import re
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(__name__ + ".slow_queries")
+
+# Longest string or bytes parameter value written to the slow query log
+MAX_PARAMETER_LENGTH = 64
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    """ SQL statements run while handling one request. """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        self.queries += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    @property
+    def duplicates(self):
+        """ Number of executions of a statement already run in this request. """
+        return sum(count - 1 for count in self.statements.values())
+
+    def server_timing(self):
+        elapsed = (time.perf_counter() - self.started) * 1000
+        return (f'db;dur={self.duration * 1000:.2f};desc="{self.queries} queries, '
+                f'{self.duplicates} duplicates", app;dur={elapsed:.2f}')
+
+
+class SQLInstrumentation:
+    """ Counts the queries, SQL time and duplicate statements of each
+        request when FLASKY_SQL_INSTRUMENTATION is set.
+
+        The totals are sent in a Server-Timing header and logged at debug
+        level. Requests that run more queries than their budget, taken
+        from FLASKY_SQL_QUERY_BUDGETS by endpoint or FLASKY_SQL_QUERY_BUDGET,
+        log a warning, or raise QueryBudgetExceeded when testing.
+
+        Statements slower than FLASKY_SLOW_DB_QUERY_TIME seconds are
+        logged as JSON, with the query plan of SELECTs, to the slow
+        queries logger and to the FLASKY_SLOW_QUERY_LOG file if set.
+        Parameters can hold emails and password hashes, so they are only
+        logged, truncated, with FLASKY_SLOW_QUERY_LOG_PARAMETERS. Batches
+        run with executemany only log their number of rows.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = app.config["FLASKY_SLOW_QUERY_LOG"]
+        if path and not any(getattr(handler, "baseFilename", None) == path
+                            for handler in slow_query_logger.handlers):
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            slow_query_logger.addHandler(handler)
+            slow_query_logger.setLevel(logging.WARNING)
+        with app.app_context():
+            for engine in app.extensions["sqlalchemy"].engines.values():
+                event.listen(engine, "before_cursor_execute", self._before_execute)
+                event.listen(engine, "after_cursor_execute", self._after_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    @staticmethod
+    def current():
+        """ Returns the stats of the current request, if it is instrumented. """
+        if has_request_context():
+            return g.get("sql_stats")
+        return None
+
+    def _start_request(self):
+        if current_app.config["FLASKY_SQL_INSTRUMENTATION"]:
+            g.sql_stats = RequestStats()
+
+    @staticmethod
+    def _slow_query_time():
+        if has_app_context():
+            return current_app.config["FLASKY_SLOW_DB_QUERY_TIME"]
+        return None
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.current() is not None or self._slow_query_time() is not None:
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not conn.info.get("query_start"):
+            return
+        duration = time.perf_counter() - conn.info["query_start"].pop()
+        stats = self.current()
+        if stats is not None:
+            stats.record(statement, duration)
+        threshold = self._slow_query_time()
+        if threshold is not None and duration >= threshold:
+            self._log_slow_query(conn, statement, parameters, executemany, duration)
+
+    def _log_slow_query(self, conn, statement, parameters, executemany, duration):
+        entry = {
+            "time": time.time(),
+            "duration": duration,
+            "endpoint": request.endpoint if has_request_context() else None,
+            "statement": statement,
+            "parameters": self._loggable_parameters(parameters, executemany),
+            "plan": None,
+        }
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            entry["plan"] = explain(conn, statement, parameters)
+        slow_query_logger.warning(json.dumps(entry, default=str))
+
+    @staticmethod
+    def _loggable_parameters(parameters, executemany):
+        if executemany:
+            return {"rows": len(parameters)}
+        if not current_app.config["FLASKY_SLOW_QUERY_LOG_PARAMETERS"]:
+            return None
+        if isinstance(parameters, dict):
+            return {key: _truncate(value) for key, value in parameters.items()}
+        return [_truncate(value) for value in parameters]
+
+    def _finish_request(self, response):
+        stats = g.pop("sql_stats", None)
+        if stats is None:
+            return response
+        response.headers.add("Server-Timing", stats.server_timing())
+        logger.debug("%s %s: %d queries, %.2f ms, %d duplicates",
+                     request.method, request.endpoint, stats.queries,
+                     stats.duration * 1000, stats.duplicates)
+        for statement, count in stats.statements.items():
+            if count > 1:
+                logger.debug("Statement ran %d times: %s", count, statement)
+
+        budget = current_app.config["FLASKY_SQL_QUERY_BUDGETS"].get(
+            request.endpoint, current_app.config["FLASKY_SQL_QUERY_BUDGET"])
+        if budget is not None and stats.queries > budget:
+            message = (f"{request.endpoint} ran {stats.queries} queries, "
+                       f"over its budget of {budget}")
+            if current_app.testing:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+def _truncate(value):
+    if isinstance(value, (str, bytes)) and len(value) > MAX_PARAMETER_LENGTH:
+        return value[:MAX_PARAMETER_LENGTH] + ("..." if isinstance(value, str) else b"...")
+    return value
+
+
+def explain(conn, statement, parameters):
+    """ Returns the query plan of statement as a list of rows.
+
+        Runs on a separate DBAPI cursor of the same connection, so it
+        sees the same transaction and doesn't fire engine events.
+    """
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [list(row) for row in cursor.fetchall()]
+    except Exception:
+        logger.exception("Could not explain slow query")
+        return None
+    finally:
+        cursor.close()
+
+
+def normalize_statement(statement):
+    """ Strips literals and collapses IN lists, so that statements that
+        differ only in their values compare equal.
+    """
+    statement = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    statement = re.sub(r"\b\d+(?:\.\d+)?\b", "?", statement)
+    statement = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?)", statement)
+    return " ".join(statement.split())
+
+
+def aggregate_slow_queries(lines):
+    """ Groups slow query log lines by normalized statement.
+
+        Returns a list of dictionaries with the count, total and maximum
+        duration, endpoints and last plan of each statement, slowest
+        total first.
+    """
+    groups = {}
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        key = normalize_statement(entry["statement"])
+        group = groups.setdefault(key, {
+            "statement": key, "count": 0, "total": 0.0, "max": 0.0,
+            "endpoints": Counter(), "plan": None,
+        })
+        group["count"] += 1
+        group["total"] += entry["duration"]
+        group["max"] = max(group["max"], entry["duration"])
+        group["endpoints"][entry["endpoint"] or "-"] += 1
+        group["plan"] = entry["plan"] or group["plan"]
+    return sorted(groups.values(), key=lambda group: group["total"], reverse=True)
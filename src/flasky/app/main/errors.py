@@ -8,7 +8,7 @@ def handle_error(message, status_code, template):
         response = jsonify({"error": message})
         response.status_code = status_code
         return response
-    return render_template(template)
+    return render_template(template), status_code
 
 
 @main.app_errorhandler(403)
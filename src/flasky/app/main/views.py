@@ -1,13 +1,17 @@
+import io
+import re
 from flask import abort, current_app, flash, \
-    make_response, render_template, request, redirect, url_for
+    make_response, render_template, request, redirect, send_file, url_for
 from flask_login import current_user, login_required
 
 
-from flasky.app import db
-from flasky.app.models import Comment, User, Role, Permission, Post
+from flasky.app import db, page_cache
+from flasky.app.avatars import avatar_path, cached_avatar_path, identicon, snap_size
+from flasky.app.models import Comment, User, Role, Permission, Post, with_author
 from flasky.app.decorators import admin_required, permission_required
 from flasky.app.main import main
 from flasky.app.main.forms import CommentForm, EditProfileForm, EditProfileAdminForm, PostForm
+from flasky.app.replicas import use_primary
 
 
 @main.route("/all")
@@ -27,6 +31,7 @@ def show_followed():
 
 
 @main.route('/', methods=['GET', "POST"])
+@page_cache.cached()
 def index():
     form = PostForm()
     if current_user.can(Permission.WRITE_ARTICLES) and \
@@ -44,11 +49,11 @@ def index():
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get("show_followed", ""))
     if show_followed:
-        query = current_user.followed_posts
+        query = current_user.followed_posts_by_time()
     else:
-        query = Post.query
+        query = Post.query.order_by(Post.timestamp.desc())
 
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
+    pagination = query.options(with_author(Post)).paginate(
         page=page, per_page=current_app.config["FLASKY_POSTS_PER_PAGE"],
         error_out=False
     )
@@ -63,11 +68,13 @@ def index():
 
 
 @main.route("/user/<username>")
+@page_cache.cached(lambda username: ("user", username))
 def user(username):
     user_ = User.query.filter_by(username=username).first()
     if user_ is None:
         abort(404)
-    posts = user_.posts.order_by(Post.timestamp.desc()).all()
+    posts = user_.posts.options(with_author(Post))\
+        .order_by(Post.timestamp.desc()).all()
     return render_template("user.html", user=user_, posts=posts)
 
 
@@ -120,7 +127,7 @@ def edit_profile_admin(id):
 
 @main.route("/post/<int:id>", methods=["GET", "POST"])
 def post(id):
-    post_ = Post.query.get_or_404(id)
+    post_ = Post.query.options(with_author(Post)).get_or_404(id)
     form = CommentForm()
     if current_user.can(Permission.COMMENT) \
             and form.validate_on_submit():
@@ -136,9 +143,10 @@ def post(id):
 
     page = request.args.get("page", 1, type=int)
     if page == -1:
-        page = (post_.comments.count() - 1) // \
+        page = (post_.comment_count - 1) // \
                 current_app.config["FLASKY_COMMENTS_PER_PAGE"] + 1
-    pagination = post_.comments.order_by(Comment.timestamp.asc()).paginate(
+    pagination = post_.comments.options(with_author(Comment))\
+        .order_by(Comment.timestamp.asc()).paginate(
         page=page, per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"],
         error_out=False
     )
@@ -170,6 +178,7 @@ def edit(id):
 
 
 @main.route("/follow/<username>")
+@use_primary
 @login_required
 @permission_required(Permission.FOLLOW)
 def follow(username):
@@ -187,6 +196,7 @@ def follow(username):
 
 
 @main.route("/unfollow/<username>")
+@use_primary
 @login_required
 @permission_required(Permission.FOLLOW)
 def unfollow(username):
@@ -213,8 +223,10 @@ def followers(username):
     pagination = user_.followers.paginate(
         page=page,
         per_page=current_app.config["FLASKY_FOLLOWERS_PER_PAGE"],
-        error_out=False
+        error_out=False,
+        count=False
     )
+    pagination.total = user_.follower_count
     follows = [
         {"user": item.follower, "timestamp": item.timestamp}
         for item in pagination.items
@@ -239,8 +251,10 @@ def followed_by(username):
     pagination = user_.followed.paginate(
         page=page,
         per_page=current_app.config["FLASKY_FOLLOWERS_PER_PAGE"],
-        error_out=False
+        error_out=False,
+        count=False
     )
+    pagination.total = user_.followed_count
     follows = [
         {"user": item.followed, "timestamp": item.timestamp}
         for item in pagination.items
@@ -260,7 +274,8 @@ def followed_by(username):
 @permission_required(Permission.MODERATE)
 def moderate():
     page = request.args.get("page", 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
+    pagination = Comment.query.options(with_author(Comment))\
+        .order_by(Comment.timestamp.desc()).paginate(
         page=page, per_page=current_app.config["FLASKY_COMMENTS_PER_PAGE"],
         error_out=False
     )
@@ -274,6 +289,7 @@ def moderate():
 
 
 @main.route("/moderate/enable/<int:id>")
+@use_primary
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_enable(id):
@@ -287,6 +303,7 @@ def moderate_enable(id):
 
 
 @main.route("/moderate/disable/<int:id>")
+@use_primary
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_disable(id):
@@ -299,6 +316,36 @@ def moderate_disable(id):
     )
 
 
+@main.route("/avatar/<avatar_hash>")
+def avatar(avatar_hash):
+    if not re.fullmatch("[0-9a-f]{32}", avatar_hash):
+        abort(404)
+    size = snap_size(request.args.get("s", 80, type=int))
+    path = cached_avatar_path(avatar_hash, size)
+    if path is None and db.session.query(User.id).filter_by(avatar_hash=avatar_hash).first():
+        path = avatar_path(avatar_hash, size)
+    # Only the avatars of existing users are written to disk, any other
+    # hash is drawn for the request alone
+    image = path or io.BytesIO(identicon(avatar_hash, size))
+    response = send_file(image, mimetype="image/png",
+                         max_age=current_app.config["FLASKY_AVATAR_MAX_AGE"])
+    response.cache_control.immutable = True
+    return response
+
+
+@main.route("/metrics")
+@login_required
+@admin_required
+def metrics():
+    # Registered only when FLASKY_METRICS is on
+    collector = current_app.extensions.get("metrics")
+    if collector is None:
+        abort(404)
+    response = make_response(collector.render())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+
 @main.route("/shutdown")
 def server_shutdown():
     if not current_app.testing:
@@ -0,0 +1,182 @@
+from bisect import bisect_left
+from collections import Counter
+import threading
+import time
+from flask import current_app, g, request
+
+# Request latency buckets in seconds, the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Yields (upper bound, observations up to it) pairs. """
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """ Request metrics labelled by endpoint, in Prometheus text format.
+
+        Records a latency histogram and the response status codes of each
+        endpoint, and the number of requests in flight. Database pool
+        usage and the stats of registered caches are read when the
+        metrics are rendered, so they cost nothing per request.
+    """
+
+    def __init__(self, app=None):
+        self.buckets = DEFAULT_BUCKETS
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._responses = Counter()
+        self._caches = {}
+        self.in_flight = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config["FLASKY_METRICS"]:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request)
+        app.extensions["metrics"] = self
+
+    def register_cache(self, name, stats):
+        """ Exports the hits and misses returned by the stats callable. """
+        self._caches[name] = stats
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+
+    def _record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _finish_request(self, exc):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        duration = time.perf_counter() - start
+        status = g.pop("metrics_status", 500)
+        endpoint = request.endpoint or "unmatched"
+        with self._lock:
+            self.in_flight -= 1
+            histogram = self._latency.get(endpoint)
+            if histogram is None:
+                histogram = self._latency[endpoint] = Histogram(self.buckets)
+            histogram.observe(duration)
+            self._responses[endpoint, status] += 1
+
+    def render(self):
+        """ Returns all metrics in the Prometheus text exposition format. """
+        with self._lock:
+            latency = {endpoint: (list(histogram.cumulative()), histogram.sum, histogram.count)
+                       for endpoint, histogram in self._latency.items()}
+            responses = dict(self._responses)
+            in_flight = self.in_flight
+
+        lines = [
+            "# HELP flasky_request_duration_seconds Request latency by endpoint.",
+            "# TYPE flasky_request_duration_seconds histogram",
+        ]
+        for endpoint, (buckets, total, count) in sorted(latency.items()):
+            for bound, observations in buckets:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'flasky_request_duration_seconds_bucket'
+                             f'{{endpoint="{endpoint}",le="{le}"}} {observations}')
+            lines.append(f'flasky_request_duration_seconds_sum{{endpoint="{endpoint}"}} {total}')
+            lines.append(f'flasky_request_duration_seconds_count{{endpoint="{endpoint}"}} {count}')
+
+        lines += [
+            "# HELP flasky_requests_total Responses by endpoint and status code.",
+            "# TYPE flasky_requests_total counter",
+        ]
+        for (endpoint, status), count in sorted(responses.items()):
+            lines.append(f'flasky_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP flasky_requests_in_flight Requests being handled.",
+            "# TYPE flasky_requests_in_flight gauge",
+            f"flasky_requests_in_flight {in_flight}",
+        ]
+        lines += self._render_pools()
+        lines += self._render_caches()
+        lines += self._render_mail()
+        return "\n".join(lines) + "\n"
+
+    def _render_pools(self):
+        lines = [
+            "# HELP flasky_db_pool_connections Database connections by state.",
+            "# TYPE flasky_db_pool_connections gauge",
+        ]
+        engines = current_app.extensions["sqlalchemy"].engines
+        for bind, engine in engines.items():
+            pool = engine.pool
+            # Not every pool class, e.g. SQLite's StaticPool, keeps counts
+            for state, method in (("size", "size"), ("checked_out", "checkedout"),
+                                  ("overflow", "overflow")):
+                if callable(getattr(pool, method, None)):
+                    lines.append(f'flasky_db_pool_connections'
+                                 f'{{bind="{bind or "default"}",state="{state}"}} '
+                                 f'{getattr(pool, method)()}')
+        return lines
+
+    def _render_caches(self):
+        lines = [
+            "# HELP flasky_cache_requests_total Cache lookups by result.",
+            "# TYPE flasky_cache_requests_total counter",
+        ]
+        stats = {name: get_stats() for name, get_stats in sorted(self._caches.items())}
+        for name, cache in stats.items():
+            lines.append(f'flasky_cache_requests_total{{cache="{name}",result="hit"}} {cache["hits"]}')
+            lines.append(f'flasky_cache_requests_total{{cache="{name}",result="miss"}} {cache["misses"]}')
+        lines += [
+            "# HELP flasky_cache_hit_ratio Fraction of cache lookups that hit.",
+            "# TYPE flasky_cache_hit_ratio gauge",
+        ]
+        for name, cache in stats.items():
+            lines.append(f'flasky_cache_hit_ratio{{cache="{name}"}} {cache["hit_rate"]}')
+        return lines
+
+    @staticmethod
+    def _render_mail():
+        mail_queue = current_app.extensions.get("mail_queue")
+        if mail_queue is None:
+            return []
+        stats = mail_queue.stats()
+        lines = [
+            "# HELP flasky_mail_queue_depth Messages waiting for a mail worker.",
+            "# TYPE flasky_mail_queue_depth gauge",
+            f"flasky_mail_queue_depth {stats['queue_depth']}",
+            "# HELP flasky_mail_messages_total Messages by outcome.",
+            "# TYPE flasky_mail_messages_total counter",
+        ]
+        for result in ("sent", "failed", "dropped", "retried"):
+            lines.append(f'flasky_mail_messages_total{{result="{result}"}} {stats[result]}')
+        lines += [
+            "# HELP flasky_mail_delivery_seconds Time from queueing to delivery.",
+            "# TYPE flasky_mail_delivery_seconds summary",
+            f"flasky_mail_delivery_seconds_sum {stats['latency_total']}",
+            f"flasky_mail_delivery_seconds_count {stats['sent']}",
+            "# HELP flasky_mail_delivery_max_seconds Slowest delivery so far.",
+            "# TYPE flasky_mail_delivery_max_seconds gauge",
+            f"flasky_mail_delivery_max_seconds {stats['latency_max']}",
+        ]
+        return lines
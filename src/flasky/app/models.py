@@ -1,14 +1,14 @@
 import datetime
 import hashlib
-import bleach
-from flask import current_app, request, url_for
+from flask import current_app, has_app_context, request, url_for
 from flask_login import UserMixin, AnonymousUserMixin
-from itsdangerous import URLSafeTimedSerializer as Serializer
-from itsdangerous.exc import BadSignature
-from markdown import markdown
+from markupsafe import escape
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from flasky.app import db, login_manager
+from flasky.app import db, login_manager, renderer
+from flasky.app.avatars import snap_size
+from flasky.app.renderer import COMMENT_TAGS, POST_TAGS
+from flasky.app.tokens import generate_token, load_token
 
 
 class Permission:
@@ -73,6 +73,10 @@ class Role(db.Model):
 
 class Follow(db.Model):
     __tablename__ = "follows"
+    __table_args__ = (
+        # The primary key serves "who does X follow", this serves "who follows X"
+        db.Index("ix_follows_followed_id_follower_id", "followed_id", "follower_id"),
+    )
     follower_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     followed_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -91,7 +95,13 @@ class User(UserMixin, db.Model):
     about_me = db.Column(db.Text())
     member_since = db.Column(db.DateTime(), default=datetime.datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.datetime.utcnow)
-    avatar_hash = db.Column(db.String(32))
+    avatar_hash = db.Column(db.String(32), index=True)
+    post_count = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    comment_count = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    follower_count = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    followed_count = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
     posts = db.relationship("Post", backref="author", lazy="dynamic")
     followed = db.relationship(
         "Follow",
@@ -131,33 +141,25 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
 
     def generate_confirmation_token(self):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
-        return serializer.dumps({"confirm": self.id})
+        return generate_token("confirm", {"confirm": self.id})
 
     def confirm(self, token, expiration=3600):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
-        try:
-            data = serializer.loads(token, max_age=expiration)
-        except BadSignature:
-            return False
-        if data.get("confirm") != self.id:
+        data = load_token("confirm", token, expiration)
+        if data is None or data.get("confirm") != self.id:
             return False
         self.confirmed = True
         db.session.add(self)
         return True
 
     def generate_reset_token(self):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
-        return serializer.dumps({"reset": self.id})
+        return generate_token("reset", {"reset": self.id})
 
     @staticmethod
     def reset_password(token, new_password, expiration=3600):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
-        try:
-            data = serializer.loads(token, max_age=expiration)
-        except BadSignature:
+        data = load_token("reset", token, expiration)
+        if data is None:
             return False
-        user = User.query.get(data.get("reset"))
+        user = db.session.get(User, data.get("reset"))
         if user is None:
             return False
         user.password = new_password
@@ -165,14 +167,11 @@ class User(UserMixin, db.Model):
         return True
 
     def generate_email_change_token(self, new_email):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
-        return serializer.dumps({"change_email": self.id, "new_email": new_email})
+        return generate_token("change-email", {"change_email": self.id, "new_email": new_email})
 
     def change_email(self, token, expiration=3600):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
-        try:
-            data = serializer.loads(token, max_age=expiration)
-        except BadSignature:
+        data = load_token("change-email", token, expiration)
+        if data is None:
             return False
 
         if data.get("change_email") != self.id:
@@ -204,6 +203,9 @@ class User(UserMixin, db.Model):
         return hashlib.md5(self.email.lower().encode("utf-8")).hexdigest()
 
     def gravatar(self, size=100, default="identicon", rating="g"):
+        if current_app.config["FLASKY_AVATAR_MODE"] == "local":
+            return url_for("main.avatar", avatar_hash=self.avatar_hash or self.gravatar_hash(),
+                           s=snap_size(size))
         if request.is_secure:
             url = "https://secure.gravatar.com/avatar"
         else:
@@ -240,9 +242,27 @@ class User(UserMixin, db.Model):
 
     @property
     def followed_posts(self):
+        if Timeline.enabled():
+            return Post.query.join(Timeline, Timeline.post_id == Post.id)\
+                .filter(Timeline.user_id == self.id)
         return Post.query.join(Follow, Follow.followed_id == Post.author_id)\
                 .filter(Follow.follower_id == self.id)
 
+    @staticmethod
+    def followed_posts_key():
+        # With materialized timelines the ordering comes from the
+        # (user_id, timestamp, post_id) index instead of a sort over the
+        # joined posts
+        if Timeline.enabled():
+            return Timeline.timestamp, Timeline.post_id
+        return Post.timestamp, Post.id
+
+    def followed_posts_by_time(self, descending=True):
+        columns = self.followed_posts_key()
+        if descending:
+            columns = [column.desc() for column in columns]
+        return self.followed_posts.order_by(*columns)
+
     @staticmethod
     def add_self_follows():
         for user in User.query.all():
@@ -252,17 +272,22 @@ class User(UserMixin, db.Model):
                 db.session.commit()
 
     def generate_auth_token(self):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
-        return serializer.dumps({"confirm": self.id})
+        # The claims needed to authorize API requests travel in the token,
+        # so they can be checked without loading the user
+        return generate_token("auth", {
+            "id": self.id,
+            "permissions": self.role.permissions if self.role is not None else 0,
+            "confirmed": bool(self.confirmed),
+        })
 
     @staticmethod
-    def verify_auth_token(token, expiration=3600):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
-        try:
-            data = serializer.loads(token, max_age=expiration)
-        except BadSignature:
-            return
-        return User.query.get(data["id"])
+    def verify_auth_token(token, expiration=None):
+        if expiration is None:
+            expiration = current_app.config["FLASKY_API_TOKEN_EXPIRATION"]
+        data = load_token("auth", token, expiration)
+        if data is None:
+            return None
+        return TokenUser(data["id"], data["permissions"], data["confirmed"])
 
     def to_json(self):
         return {
@@ -272,13 +297,40 @@ class User(UserMixin, db.Model):
             "last_seen": self.last_seen,
             "post_url": url_for("api.get_user_posts", id=self.id),
             "followed_posts_url": url_for("api.get_user_followed_posts", id=self.id),
-            "post_count": self.posts.count(),
+            "post_count": self.post_count,
         }
 
     def __repr__(self):
         return '<User %r>' % self.username
 
 
+class TokenUser:
+    """ User snapshot taken from the claims of a verified API token.
+
+        It answers the authorization checks of the API without a database
+        lookup. Permission changes take effect when the token expires.
+    """
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, id, permissions, confirmed):
+        self.id = id
+        self.permissions = permissions
+        self.confirmed = confirmed
+
+    def can(self, perm):
+        return self.permissions & perm == perm
+
+    def is_administrator(self):
+        return self.can(Permission.ADMIN)
+
+    def get_user(self):
+        return db.session.get(User, self.id)
+
+    def __repr__(self):
+        return '<TokenUser %r>' % self.id
+
+
 class AnonymousUser(AnonymousUserMixin):
 
     def can(self, permissions):
@@ -290,7 +342,7 @@ class AnonymousUser(AnonymousUserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return User.query.options(db.joinedload(User.role)).get(int(user_id))
 
 
 login_manager.anonymous_user = AnonymousUser
@@ -300,37 +352,48 @@ class ValidationError(ValueError):
     pass
 
 
+def html_or_escaped(body_html, body):
+    """ Returns the rendered HTML of a body, or the escaped body while
+        rendering is deferred.
+    """
+    if body_html is not None or body is None:
+        return body_html
+    return str(escape(body))
+
+
 class Post(db.Model):
     __tablename__ = "posts"
+    __table_args__ = (
+        db.Index("ix_posts_author_id_timestamp", "author_id", "timestamp"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True,
                           default=datetime.datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    comment_count = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
     comments = db.relationship("Comment", backref="post", lazy="dynamic")
 
+    ALLOWED_TAGS = POST_TAGS
+
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = [
-            "a", "abbr", "acronym", "b", "blockquote", "code",
-            "em", "i", "li", "ol", "pre", "strong", "ul", "h1",
-            "h2", "h3", "p"
-        ]
-        target.body_html = bleach.linkify(
-            bleach.clean(markdown(value, output_format="html"),
-                         tags=allowed_tags, strip=True),
-        )
+        if value == oldvalue and target.body_html is not None:
+            return
+        target.body_html = renderer.render_or_defer(value, Post.ALLOWED_TAGS)
 
     def to_json(self):
         return {
             "url": url_for("api.get_posts", id=self.id),
             "body": self.body,
-            "body_html": self.body_html,
+            "body_html": html_or_escaped(self.body_html, self.body),
             "timestamp": self.timestamp,
             "author_url": url_for("api.get_user", id=self.author_id),
             "comments_url": url_for("api.get_post_comments", id=self.id),
-            "comment_count": self.comments.count()
+            "comment_count": self.comment_count
         }
 
     @staticmethod
@@ -346,6 +409,9 @@ db.event.listen(Post.body, "set", Post.on_changed_body)
 
 class Comment(db.Model):
     __tablename__ = "comments"
+    __table_args__ = (
+        db.Index("ix_comments_post_id_timestamp", "post_id", "timestamp"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
@@ -354,21 +420,21 @@ class Comment(db.Model):
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow,
+                           onupdate=datetime.datetime.utcnow)
+
+    ALLOWED_TAGS = COMMENT_TAGS
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = [
-            "a", "abbr", "acronym", "b", "code", "em", "strong",
-        ]
-        target.body_html = bleach.linkify(
-            bleach.clean(markdown(value, output_format="html"),
-                         tags=allowed_tags, strip=True),
-        )
+        if value == oldvalue and target.body_html is not None:
+            return
+        target.body_html = renderer.render_or_defer(value, Comment.ALLOWED_TAGS)
 
     def to_json(self):
         return {
             "body": self.body,
-            "body_html": self.body_html,
+            "body_html": html_or_escaped(self.body_html, self.body),
             "timestamp": self.timestamp,
             "url": url_for("api.get_comment", id=self.id),
             "author_url": url_for("api.get_user", id=self.author_id),
@@ -384,3 +450,160 @@ class Comment(db.Model):
 
 
 db.event.listen(Comment.body, "set", Comment.on_changed_body)
+
+
+def with_author(model):
+    """ Loader option that fetches the author of each row, and the author's
+        role, in the same query as the rows themselves.
+    """
+    return db.joinedload(model.author).joinedload(User.role)
+
+
+class Timeline(db.Model):
+    """ Materialized home timeline. One row per (follower, post) pair. """
+    __tablename__ = "timelines"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), primary_key=True)
+    timestamp = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index("ix_timelines_user_id_timestamp_post_id", "user_id", "timestamp", "post_id"),
+    )
+
+    @staticmethod
+    def enabled():
+        return has_app_context() and \
+            current_app.config.get("FLASKY_MATERIALIZED_TIMELINES", False)
+
+    @staticmethod
+    def on_post_insert(mapper, connection, target):
+        """ Fan out a new post to the timelines of the author's followers. """
+        if not Timeline.enabled():
+            return
+        connection.execute(
+            db.insert(Timeline).from_select(
+                ["user_id", "post_id", "timestamp"],
+                db.select(Follow.follower_id,
+                          db.literal(target.id),
+                          db.literal(target.timestamp, db.DateTime))
+                .where(Follow.followed_id == target.author_id)
+            )
+        )
+
+    @staticmethod
+    def on_post_delete(mapper, connection, target):
+        if not Timeline.enabled():
+            return
+        connection.execute(
+            db.delete(Timeline).where(Timeline.post_id == target.id)
+        )
+
+    @staticmethod
+    def on_follow_insert(mapper, connection, target):
+        """ Backfill the follower's timeline with the followed user's posts. """
+        if not Timeline.enabled():
+            return
+        connection.execute(
+            db.insert(Timeline).from_select(
+                ["user_id", "post_id", "timestamp"],
+                db.select(db.literal(target.follower_id), Post.id, Post.timestamp)
+                .where(Post.author_id == target.followed_id)
+            )
+        )
+
+    @staticmethod
+    def on_follow_delete(mapper, connection, target):
+        """ Prune the unfollowed user's posts from the follower's timeline. """
+        if not Timeline.enabled():
+            return
+        connection.execute(
+            db.delete(Timeline)
+            .where(Timeline.user_id == target.follower_id)
+            .where(Timeline.post_id.in_(
+                db.select(Post.id).where(Post.author_id == target.followed_id)
+            ))
+        )
+
+    @staticmethod
+    def rebuild():
+        """ Rebuilds every timeline from the posts and follows tables. """
+        db.session.execute(db.delete(Timeline))
+        db.session.execute(
+            db.insert(Timeline).from_select(
+                ["user_id", "post_id", "timestamp"],
+                db.select(Follow.follower_id, Post.id, Post.timestamp)
+                .join(Post, Post.author_id == Follow.followed_id)
+            )
+        )
+        db.session.commit()
+
+
+db.event.listen(Post, "after_insert", Timeline.on_post_insert)
+db.event.listen(Post, "after_delete", Timeline.on_post_delete)
+db.event.listen(Follow, "after_insert", Timeline.on_follow_insert)
+db.event.listen(Follow, "after_delete", Timeline.on_follow_delete)
+
+
+# Stored counters and the foreign key of the counted rows that points
+# at the row holding each counter
+COUNTERS = {
+    Post: [(User.post_count, Post.author_id)],
+    Comment: [(User.comment_count, Comment.author_id),
+              (Post.comment_count, Comment.post_id)],
+    Follow: [(User.followed_count, Follow.follower_id),
+             (User.follower_count, Follow.followed_id)],
+}
+
+
+def counter_listener(counters, delta):
+    """ Builds a mapper event listener that adds delta to the counters
+        of the rows referenced by the inserted or deleted target.
+    """
+    def listener(mapper, connection, target):
+        for counter, foreign_key in counters:
+            owner_id = getattr(target, foreign_key.key)
+            if owner_id is None:
+                continue
+            owner = counter.class_
+            connection.execute(
+                db.update(owner)
+                .where(owner.id == owner_id)
+                .values({counter: counter + delta})
+            )
+    return listener
+
+
+for counted_model, model_counters in COUNTERS.items():
+    db.event.listen(counted_model, "after_insert", counter_listener(model_counters, 1))
+    db.event.listen(counted_model, "after_delete", counter_listener(model_counters, -1))
+
+
+def reconcile_counters():
+    """ Recomputes every stored counter from the rows it counts.
+
+        Returns the number of rows whose counters had drifted.
+    """
+    repaired = set()
+    for model_counters in COUNTERS.values():
+        for counter, foreign_key in model_counters:
+            # One grouped scan of the counted rows instead of a correlated
+            # subquery per owner row
+            actual = dict(db.session.execute(
+                db.select(foreign_key, db.func.count()).group_by(foreign_key)
+            ).all())
+            owner = counter.class_
+            drifted = [
+                {"owner_id": owner_id, "actual": actual.get(owner_id, 0)}
+                for owner_id, stored in db.session.execute(db.select(owner.id, counter))
+                if stored != actual.get(owner_id, 0)
+            ]
+            if drifted:
+                table = owner.__table__
+                db.session.execute(
+                    db.update(table)
+                    .where(table.c.id == db.bindparam("owner_id"))
+                    .values({counter.key: db.bindparam("actual")}),
+                    drifted
+                )
+            repaired.update((owner.__tablename__, row["owner_id"]) for row in drifted)
+    db.session.commit()
+    return len(repaired)
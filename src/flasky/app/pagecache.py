@@ -0,0 +1,202 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import wraps
+import logging
+import threading
+import time
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from flasky.app.cache import LRUCache
+from flasky.app.replicas import read_from_primary
+
+logger = logging.getLogger(__name__)
+
+# WSGI environ key marking the background requests that refresh an entry
+REFRESH_KEY = "flasky.page_cache.refresh"
+# User columns shown on profile pages
+PROFILE_FIELDS = ("username", "name", "location", "about_me", "avatar_hash", "role_id")
+
+
+class PageCache:
+    """ Caches whole responses of views for anonymous visitors.
+
+        Views opt in with the cached decorator. Entries are keyed by URL
+        root, endpoint, view arguments and page number, and remember the
+        generation of their scopes when they were rendered. Committing a
+        new, edited or deleted post bumps the generation of every page,
+        and a profile change bumps the generation of that user's page.
+        New and deleted comments bump every page, as the comment counts
+        are shown everywhere, and a follow bumps the pages of both users.
+
+        An entry whose generation changed, or that is older than
+        FLASKY_PAGE_CACHE_TTL seconds, is stale. Stale entries are still
+        served for FLASKY_PAGE_CACHE_MAX_STALE seconds while a background
+        thread renders a fresh copy, so no visitor waits for the render.
+    """
+
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        self._generations = Counter()
+        self._refreshing = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix="page-cache")
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache.resize(app.config["FLASKY_PAGE_CACHE_ENTRIES"],
+                          app.config["FLASKY_PAGE_CACHE_MAX_SIZE"])
+        if not self._listening:
+            self._listen()
+
+    def cached(self, scope=None):
+        """ Caches the anonymous GET responses of a view. scope is called
+            with the view arguments and returns the scope of the page,
+            which invalidate() can target.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                if not self._cacheable():
+                    return view(**kwargs)
+                # The URL root, as links and avatars depend on the scheme,
+                # host and script root
+                key = repr((request.url_root, request.endpoint, sorted(kwargs.items()),
+                            request.args.get("page", 1, type=int)))
+                scopes = ("all",) if scope is None else ("all", scope(**kwargs))
+                if not request.environ.get(REFRESH_KEY):
+                    entry = self.cache.get(key)
+                    if entry is not None:
+                        response = self._serve(key, entry, scopes)
+                        if response is not None:
+                            return response
+                # Taken before rendering, so an invalidation committed
+                # during the render leaves the new entry stale
+                version = self._version(scopes)
+                # A lagging replica would be cached until the next change
+                read_from_primary()
+                response = make_response(view(**kwargs))
+                if response.status_code == 200:
+                    body = response.get_data()
+                    self.cache.set(key, (body, response.mimetype, version, time.monotonic()))
+                response.headers["X-Page-Cache"] = "miss"
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate(self, scope="all"):
+        with self._lock:
+            self._generations[scope] += 1
+
+    def join(self):
+        """ Waits for the background refreshes in progress. """
+        with self._lock:
+            futures = list(self._refreshing.values())
+        wait(futures)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+    @staticmethod
+    def _cacheable():
+        return current_app.config["FLASKY_PAGE_CACHE"] and \
+            request.method == "GET" and \
+            current_user.is_anonymous and \
+            "_flashes" not in session
+
+    def _version(self, scopes):
+        with self._lock:
+            return tuple(self._generations[scope] for scope in scopes)
+
+    def _serve(self, key, entry, scopes):
+        """ Returns the cached response, refreshing it if it is stale, or
+            None if the entry is too old to be served.
+        """
+        body, mimetype, version, created = entry
+        age = time.monotonic() - created
+        ttl = current_app.config["FLASKY_PAGE_CACHE_TTL"]
+        if version == self._version(scopes) and age < ttl:
+            state = "hit"
+        elif age < ttl + current_app.config["FLASKY_PAGE_CACHE_MAX_STALE"]:
+            state = "stale"
+            self._refresh(key)
+        else:
+            return None
+        response = current_app.response_class(body, mimetype=mimetype)
+        response.headers["X-Page-Cache"] = state
+        return response
+
+    def _refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            # The URL root keeps the scheme, host and script root of the
+            # original request in the links of the refreshed page
+            self._refreshing[key] = self._executor.submit(
+                self._render, current_app._get_current_object(), key,
+                request.full_path, request.url_root)
+
+    def _render(self, app, key, path, base_url):
+        try:
+            with app.test_request_context(path, base_url=base_url,
+                                          environ_base={REFRESH_KEY: True}):
+                app.full_dispatch_request()
+        except Exception:
+            logger.exception("Failed to refresh cached page %s", path)
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    def _listen(self):
+        from flasky.app.models import Comment, Follow, Post, User
+
+        def post_changed(mapper, connection, target):
+            Session.object_session(target).info.setdefault("page_cache", set()).add("all")
+
+        def follow_changed(mapper, connection, target):
+            # The counters are updated with plain UPDATEs, which fire no
+            # User events
+            usernames = connection.execute(
+                select(User.username)
+                .where(User.id.in_((target.follower_id, target.followed_id)))
+            ).scalars()
+            Session.object_session(target).info.setdefault("page_cache", set()).update(
+                ("user", username) for username in usernames)
+
+        def user_changed(mapper, connection, target):
+            attrs = inspect(target).attrs
+            if not any(attrs[field].history.has_changes() for field in PROFILE_FIELDS):
+                return
+            # A renamed user's page is cached under both usernames
+            history = attrs.username.history
+            usernames = set(history.added or ()) | set(history.deleted or ()) or \
+                {target.username}
+            Session.object_session(target).info.setdefault("page_cache", set()).update(
+                ("user", username) for username in usernames)
+
+        def after_commit(session_):
+            for scope in session_.info.pop("page_cache", ()):
+                self.invalidate(scope)
+
+        def after_rollback(session_, previous_transaction):
+            # A savepoint rollback keeps the changes of the outer transaction
+            if previous_transaction.parent is None:
+                session_.info.pop("page_cache", None)
+
+        for event_name in ("after_insert", "after_update", "after_delete"):
+            event.listen(Post, event_name, post_changed)
+        for event_name in ("after_insert", "after_delete"):
+            event.listen(Comment, event_name, post_changed)
+            event.listen(Follow, event_name, follow_changed)
+        event.listen(User, "after_update", user_changed)
+        event.listen(Session, "after_commit", after_commit)
+        event.listen(Session, "after_soft_rollback", after_rollback)
+        self._listening = True
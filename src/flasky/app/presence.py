@@ -0,0 +1,150 @@
+import atexit
+import datetime
+import logging
+import threading
+import time
+from flask import has_app_context
+from sqlalchemy import bindparam, update
+
+logger = logging.getLogger(__name__)
+
+
+class LastSeenBuffer:
+    """ Write-behind buffer for the last_seen column of users.
+
+        Pings are collected in memory and written with a single bulk
+        UPDATE once FLASKY_LAST_SEEN_FLUSH_SIZE users are pending or
+        FLASKY_LAST_SEEN_FLUSH_INTERVAL seconds have passed since the
+        last flush. A user is not updated again until
+        FLASKY_LAST_SEEN_MIN_INTERVAL seconds after the previous update.
+
+        The writes happen on a background thread, which ping() wakes when
+        a flush is due, so a slow or locked database never fails the
+        request that pinged. The thread also flushes every
+        FLASKY_LAST_SEEN_FLUSH_INTERVAL seconds, so pings aren't held
+        through quiet periods, and close() runs at exit. Pings of a failed
+        write are kept for the next flush.
+    """
+
+    def __init__(self, app=None):
+        self.flush_interval = 10
+        self.flush_size = 100
+        self.min_interval = datetime.timedelta(seconds=60)
+        self._pending = {}
+        self._recent = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._at_exit = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Pending pings belong to the app they were written for
+        with self._lock:
+            self._app = app
+            self._pending = {}
+            self._recent = {}
+        self.flush_interval = app.config["FLASKY_LAST_SEEN_FLUSH_INTERVAL"]
+        self.flush_size = app.config["FLASKY_LAST_SEEN_FLUSH_SIZE"]
+        self.min_interval = datetime.timedelta(
+            seconds=app.config["FLASKY_LAST_SEEN_MIN_INTERVAL"])
+
+    def ping(self, user):
+        self._start()
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            last_update = self._recent.get(user.id, user.last_seen)
+            if last_update is not None and now - last_update < self.min_interval:
+                return
+            self._recent[user.id] = now
+            self._pending[user.id] = now
+            due = len(self._pending) >= self.flush_size or \
+                time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self._wake.set()
+
+    def flush(self):
+        """ Writes the pending pings. Returns the number of users updated. """
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            self._recent = {
+                user_id: seen for user_id, seen in self._recent.items()
+                if now - seen < self.min_interval
+            }
+        if not pending:
+            return 0
+
+        try:
+            if has_app_context() or self._app is None:
+                self._write(pending)
+            else:
+                with self._app.app_context():
+                    self._write(pending)
+        except Exception:
+            with self._lock:
+                # Pings received since the batch was taken are newer
+                for user_id, seen in pending.items():
+                    self._pending.setdefault(user_id, seen)
+            raise
+        return len(pending)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        """ Stops the background thread and writes the pending pings. """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to write %d last seen times", self.pending())
+
+    @staticmethod
+    def _write(pending):
+        from flasky.app import db
+        from flasky.app.models import User
+        users = User.__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(users)
+                .where(users.c.id == bindparam("user_id"))
+                .values(last_seen=bindparam("seen_at")),
+                [{"user_id": user_id, "seen_at": seen}
+                 for user_id, seen in pending.items()]
+            )
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._wake.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name="last-seen-flush")
+            self._thread.start()
+            if not self._at_exit:
+                atexit.register(self.close)
+                self._at_exit = True
+
+    def _run(self):
+        while True:
+            self._wake.wait(max(self.flush_interval, 0.1))
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            if not self.pending():
+                continue
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write %d last seen times", self.pending())
@@ -0,0 +1,214 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import bleach
+from markdown import markdown
+from sqlalchemy import bindparam, event, update
+from sqlalchemy.orm import Session
+
+from flasky.app.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+POST_TAGS = [
+    "a", "abbr", "acronym", "b", "blockquote", "code",
+    "em", "i", "li", "ol", "pre", "strong", "ul", "h1",
+    "h2", "h3", "p"
+]
+
+COMMENT_TAGS = [
+    "a", "abbr", "acronym", "b", "code", "em", "strong",
+]
+
+
+def render_markdown(body, allowed_tags):
+    return bleach.linkify(
+        bleach.clean(markdown(body, output_format="html"),
+                     tags=allowed_tags, strip=True),
+    )
+
+
+def _render_rows(rows, allowed_tags):
+    return [(id_, body, render_markdown(body, allowed_tags), body_html)
+            for id_, body, body_html in rows]
+
+
+class MarkdownRenderer:
+    """ Renders Markdown to sanitized HTML, caching the results.
+
+        Entries are keyed by a digest of the allowed tags and the body, so
+        identical text rendered with the same tag profile is only
+        converted once.
+
+        With FLASKY_RENDER_DEFERRED, bodies that aren't cached are
+        rendered by a pool of FLASKY_RENDER_WORKERS threads after the
+        transaction that saved them commits. Until then their body_html
+        is None and readers show the escaped body.
+    """
+
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        self.deferred = False
+        self._executor = None
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache.resize(app.config["FLASKY_RENDER_CACHE_ENTRIES"],
+                          app.config["FLASKY_RENDER_CACHE_MAX_SIZE"])
+        self.deferred = app.config["FLASKY_RENDER_DEFERRED"]
+        if self.deferred:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            self._executor = ThreadPoolExecutor(
+                max_workers=app.config["FLASKY_RENDER_WORKERS"],
+                thread_name_prefix="renderer")
+            if not self._listening:
+                self._listen()
+
+    @staticmethod
+    def cache_key(body, allowed_tags):
+        digest = hashlib.sha256()
+        digest.update(" ".join(sorted(allowed_tags)).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(body.encode("utf-8"))
+        return digest.hexdigest()
+
+    def render(self, body, allowed_tags):
+        if body is None:
+            return None
+        key = self.cache_key(body, allowed_tags)
+        html = self.cache.get(key)
+        if html is None:
+            html = render_markdown(body, allowed_tags)
+            self.cache.set(key, html)
+        return html
+
+    def render_or_defer(self, body, allowed_tags):
+        """ Returns the rendered body, or None if rendering is deferred to
+            after the commit.
+        """
+        if body is not None and self.deferred:
+            html = self.cache.get(self.cache_key(body, allowed_tags))
+            if html is None:
+                return None
+        return self.render(body, allowed_tags)
+
+    def join(self):
+        """ Waits for the deferred renders in progress. """
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+
+    def stats(self):
+        return self.cache.stats()
+
+    def _submit(self, app, jobs):
+        future = self._executor.submit(self._render_jobs, app, jobs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _render_jobs(self, app, jobs):
+        from flasky.app import db, page_cache
+        from flasky.app.models import Post
+        try:
+            with app.app_context():
+                for model, id_, body in jobs:
+                    table = model.__table__
+                    html = self.render(body, model.ALLOWED_TAGS)
+                    # Skipped if the body was edited again in the meantime
+                    with db.engine.begin() as connection:
+                        connection.execute(
+                            update(table)
+                            .where(table.c.id == id_, table.c.body == body)
+                            .values(body_html=html, updated_at=datetime.datetime.utcnow())
+                        )
+                if any(model is Post for model, _, _ in jobs):
+                    page_cache.invalidate()
+        except Exception:
+            logger.exception("Failed to render %d deferred bodies", len(jobs))
+
+    def _listen(self):
+        from flask import current_app
+        from flasky.app.models import Comment, Post
+
+        def after_flush(session_, flush_context):
+            jobs = session_.info.setdefault("deferred_render", [])
+            for target in list(session_.new) + list(session_.dirty):
+                if isinstance(target, (Post, Comment)) and \
+                        target.body is not None and target.body_html is None:
+                    jobs.append((type(target), target.id, target.body))
+
+        def after_commit(session_):
+            jobs = session_.info.pop("deferred_render", None)
+            if jobs and self.deferred:
+                self._submit(current_app._get_current_object(), jobs)
+
+        def after_rollback(session_, previous_transaction):
+            # A savepoint rollback keeps the outer transaction's bodies. Those
+            # flushed inside the savepoint are skipped by the guarded UPDATE
+            if previous_transaction.parent is None:
+                session_.info.pop("deferred_render", None)
+
+        event.listen(Session, "after_flush", after_flush)
+        event.listen(Session, "after_commit", after_commit)
+        event.listen(Session, "after_soft_rollback", after_rollback)
+        self._listening = True
+
+
+def rerender(model, workers=None, batch_size=1000):
+    """ Renders the body of every row of a post or comment model again,
+        with its current allowed tags, on a pool of worker processes.
+
+        Rows are read in primary key order, one batch per query, and
+        only the rows whose HTML changed are written. Rows edited since
+        they were read are skipped. Returns the number of rows updated.
+    """
+    from flasky.app import db
+    table = model.__table__
+    query = db.select(table.c.id, table.c.body, table.c.body_html) \
+        .where(table.c.body.is_not(None)).order_by(table.c.id)
+    statement = update(table) \
+        .where(table.c.id == bindparam("row_id"), table.c.body == bindparam("old_body")) \
+        .values(body_html=bindparam("html"), updated_at=bindparam("now"))
+
+    workers = workers or os.cpu_count()
+    updated = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        last = None
+        while True:
+            batch_query = query.limit(batch_size)
+            if last is not None:
+                batch_query = batch_query.where(table.c.id > last)
+            rows = [tuple(row) for row in db.session.execute(batch_query)]
+            db.session.rollback()
+            if not rows:
+                break
+            last = rows[-1][0]
+            # A few chunks per worker, so a slow chunk doesn't idle the others
+            size = max(1, -(-len(rows) // (workers * 4)))
+            chunks = [rows[ii:ii + size] for ii in range(0, len(rows), size)]
+            now = datetime.datetime.utcnow()
+            changed = [
+                {"row_id": id_, "old_body": body, "html": html, "now": now}
+                for result in executor.map(_render_rows, chunks,
+                                           [model.ALLOWED_TAGS] * len(chunks))
+                for id_, body, html, old_html in result if html != old_html
+            ]
+            if changed:
+                with db.engine.begin() as connection:
+                    updated += connection.execute(statement, changed).rowcount
+            if len(rows) < batch_size:
+                break
+    return updated
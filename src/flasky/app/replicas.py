@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect
+
+
+def use_primary(view):
+    """ Keeps every query of a view on the primary database. Needed by
+        GET views that write, which would otherwise read from a replica.
+    """
+    view.use_primary = True
+    return view
+
+
+def read_from_primary():
+    """ Sends the remaining queries of the current request to the primary,
+        for responses that outlive the request, such as cached pages.
+    """
+    if has_request_context():
+        g.db_primary = True
+
+
+class RoutingSession(Session):
+    """ Session that runs the reads of read-only requests on a replica.
+
+        Flushes, and every query after the first flush of a request, use
+        the primary. Tables of other binds keep their own engine.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and not self._flushing and has_request_context() and \
+                engine is self._db.engines.get(None):
+            replica = current_app.extensions["replica_router"].replica(self._db.engines)
+            if replica is not None:
+                return replica
+        return engine
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _after_flush(session_, flush_context):
+    if has_request_context() and "replica_router" in current_app.extensions:
+        g.db_wrote = True
+        current_app.extensions["replica_router"].wrote()
+
+
+class ReplicaRouter:
+    """ Chooses the database that serves the queries of a request.
+
+        GET and HEAD requests read from one of the FLASKY_DB_REPLICAS
+        binds, picked at random once per request. Other methods, views
+        marked with use_primary and clients that wrote less than
+        FLASKY_DB_PRIMARY_WINDOW seconds ago use the primary, so a user
+        sees their own changes while the replicas catch up. So do requests
+        after read_from_primary(), which the page cache calls before
+        rendering a page it will serve to everyone.
+
+        Clients are told apart by their user id, whether they sign in
+        with a login session, a password or a token. Recent writes are
+        remembered by each process, so with several workers the load
+        balancer should keep a client on the same worker.
+    """
+
+    def __init__(self, app=None):
+        self._writes = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["replica_router"] = self
+        app.before_request(self._reset)
+        with self._lock:
+            self._writes.clear()
+
+    def replica(self, engines):
+        """ Returns the replica engine of the current request, or None
+            when it must use the primary.
+        """
+        if g.get("db_wrote") or g.get("db_primary"):
+            return None
+        # API requests only know their user after the authentication query,
+        # so the choice is made again once the client is known
+        key = _client_key()
+        choice = g.get("db_replica")
+        if choice is None or choice[0] != key:
+            g.db_replica = choice = (key, self._choose(engines, key))
+        return choice[1]
+
+    def wrote(self):
+        """ Keeps the reads of the current client on the primary for
+            FLASKY_DB_PRIMARY_WINDOW seconds.
+        """
+        key = _client_key()
+        if key is None or not current_app.config["FLASKY_DB_REPLICAS"]:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._writes) > 10000:
+                self._writes = {k: until for k, until in self._writes.items() if until > now}
+            self._writes[key] = now + current_app.config["FLASKY_DB_PRIMARY_WINDOW"]
+
+    def recently_wrote(self, key):
+        with self._lock:
+            return self._writes.get(key, 0) > time.monotonic()
+
+    @staticmethod
+    def _reset():
+        g.pop("db_wrote", None)
+        g.pop("db_primary", None)
+        g.pop("db_replica", None)
+
+    def _choose(self, engines, key):
+        replicas = current_app.config["FLASKY_DB_REPLICAS"]
+        if not replicas or request.method not in ("GET", "HEAD"):
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        if getattr(view, "use_primary", False):
+            return None
+        if key is not None and self.recently_wrote(key):
+            return None
+        return engines[random.choice(replicas)]
+
+
+def _client_key():
+    # The API user, set by its authentication hook, or the logged in user
+    user = g.get("current_user")
+    if user is not None and not user.is_anonymous:
+        # The identity of a loaded User, read without refreshing it since
+        # that would query the database again
+        state = inspect(user, raiseerr=False)
+        user_id = state.identity[0] if state is not None and state.identity else user.id
+        return f"user:{user_id}"
+    user_id = session.get("_user_id")
+    if user_id is not None:
+        return f"user:{user_id}"
+    return None
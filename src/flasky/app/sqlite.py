@@ -0,0 +1,23 @@
+from sqlalchemy import event
+
+
+def apply_pragmas(app):
+    """ Runs the FLASKY_SQLITE_PRAGMAS of the app on every new connection
+        of its SQLite engines.
+    """
+    pragmas = app.config["FLASKY_SQLITE_PRAGMAS"]
+    if not pragmas:
+        return
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+    with app.app_context():
+        for engine in app.extensions["sqlalchemy"].engines.values():
+            if engine.dialect.name == "sqlite":
+                event.listen(engine, "connect", on_connect)
@@ -0,0 +1,31 @@
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer
+from itsdangerous.exc import BadSignature
+
+
+def get_serializer(purpose):
+    """ Returns the serializer for purpose, creating it once per app.
+
+        Each purpose uses its own salt so a token issued for one use,
+        e.g. account confirmation, is not accepted for another.
+    """
+    serializers = current_app.extensions.setdefault("flasky_token_serializers", {})
+    serializer = serializers.get(purpose)
+    if serializer is None:
+        serializer = URLSafeTimedSerializer(
+            current_app.config["SECRET_KEY"], salt=f"flasky-{purpose}"
+        )
+        serializers[purpose] = serializer
+    return serializer
+
+
+def generate_token(purpose, data):
+    return get_serializer(purpose).dumps(data)
+
+
+def load_token(purpose, token, expiration):
+    """ Returns the data stored in token, or None if it is invalid or expired. """
+    try:
+        return get_serializer(purpose).loads(token, max_age=expiration)
+    except BadSignature:
+        return None
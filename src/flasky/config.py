@@ -13,10 +13,56 @@ class Config:
     FLASKY_MAIL_SUBJECT_PREFIX = '[Flasky]'
     FLASKY_MAIL_SENDER = 'Flasky Admin <flasky@example.com>'
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
+    FLASKY_MAIL_WORKERS = int(os.environ.get('FLASKY_MAIL_WORKERS', '2'))
+    FLASKY_MAIL_QUEUE_SIZE = 100
+    FLASKY_MAIL_BATCH_SIZE = 20
+    FLASKY_MAIL_RETRIES = 3
+    FLASKY_MAIL_RETRY_BACKOFF = 1.0
+    FLASKY_MAIL_SHUTDOWN_TIMEOUT = 10
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     FLASKY_POSTS_PER_PAGE = 20
     FLASKY_FOLLOWERS_PER_PAGE = 50
     FLASKY_COMMENTS_PER_PAGE = 30
+    FLASKY_MATERIALIZED_TIMELINES = os.environ.get(
+        'FLASKY_MATERIALIZED_TIMELINES', 'false').lower() in ['true', 'on', '1']
+    FLASKY_RENDER_CACHE_ENTRIES = 4096
+    FLASKY_RENDER_CACHE_MAX_SIZE = 16 * 1024 * 1024
+    FLASKY_RENDER_DEFERRED = os.environ.get('FLASKY_RENDER_DEFERRED', 'false').lower() in \
+        ['true', 'on', '1']
+    FLASKY_RENDER_WORKERS = 2
+    FLASKY_FRAGMENT_CACHE = True
+    FLASKY_FRAGMENT_CACHE_ENTRIES = 8192
+    FLASKY_FRAGMENT_CACHE_MAX_SIZE = 32 * 1024 * 1024
+    FLASKY_PAGE_CACHE = True
+    FLASKY_PAGE_CACHE_TTL = 60
+    FLASKY_PAGE_CACHE_MAX_STALE = 600
+    FLASKY_PAGE_CACHE_ENTRIES = 1024
+    FLASKY_PAGE_CACHE_MAX_SIZE = 64 * 1024 * 1024
+    # 'gravatar' links to gravatar.com, 'local' serves identicons from /avatar
+    FLASKY_AVATAR_MODE = os.environ.get('FLASKY_AVATAR_MODE', 'gravatar')
+    FLASKY_AVATAR_CACHE_DIR = os.environ.get('FLASKY_AVATAR_CACHE_DIR') or \
+        os.path.join(basedir, "..", 'avatar-cache')
+    FLASKY_AVATAR_MAX_AGE = 365 * 24 * 60 * 60
+    FLASKY_EXPORT_BATCH_SIZE = 1000
+    FLASKY_API_MAX_BATCH = 100
+    FLASKY_SQLITE_PRAGMAS = {}
+    FLASKY_DB_REPLICAS = []
+    FLASKY_DB_PRIMARY_WINDOW = 5
+    FLASKY_LAST_SEEN_BUFFER = True
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = 10
+    FLASKY_LAST_SEEN_FLUSH_SIZE = 100
+    FLASKY_LAST_SEEN_MIN_INTERVAL = 60
+    FLASKY_API_CREDENTIAL_CACHE_TTL = 60
+    FLASKY_API_TOKEN_EXPIRATION = 3600
+    FLASKY_SQL_INSTRUMENTATION = os.environ.get(
+        'FLASKY_SQL_INSTRUMENTATION', 'false').lower() in ['true', 'on', '1']
+    FLASKY_SQL_QUERY_BUDGET = None
+    FLASKY_SQL_QUERY_BUDGETS = {}
+    FLASKY_METRICS = True
+    FLASKY_SLOW_DB_QUERY_TIME = 0.5
+    FLASKY_SLOW_QUERY_LOG = os.environ.get('FLASKY_SLOW_QUERY_LOG')
+    FLASKY_SLOW_QUERY_LOG_PARAMETERS = os.environ.get(
+        'FLASKY_SLOW_QUERY_LOG_PARAMETERS', 'false').lower() in ['true', 'on', '1']
 
     @staticmethod
     def init_app(app):
@@ -32,6 +78,7 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
+    FLASKY_PAGE_CACHE = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite://'
 
@@ -39,6 +86,27 @@ class TestingConfig(Config):
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, "..", 'data.sqlite')
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('FLASKY_DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.environ.get('FLASKY_DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': int(os.environ.get('FLASKY_DB_POOL_TIMEOUT', '30')),
+    }
+    # WAL lets readers and the writer work at the same time. NORMAL sync
+    # is durable in WAL mode except on power loss. Ignored by other
+    # databases.
+    FLASKY_SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': int(os.environ.get('FLASKY_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+        'cache_size': -int(os.environ.get('FLASKY_SQLITE_CACHE_KB', '65536')),
+        'busy_timeout': int(os.environ.get('FLASKY_SQLITE_BUSY_TIMEOUT', '5000')),
+    }
+    # Comma separated URLs of read replicas of DATABASE_URL
+    SQLALCHEMY_BINDS = {
+        f'replica{ii}': url for ii, url in
+        enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')))
+    }
+    FLASKY_DB_REPLICAS = list(SQLALCHEMY_BINDS)
 
 
 config = {
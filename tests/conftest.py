@@ -1,5 +1,7 @@
+from contextlib import contextmanager
 import pytest
 from selenium import webdriver
+from sqlalchemy import event
 
 from flasky.app import create_app, db
 from flasky.app.models import Role
@@ -44,6 +46,24 @@ def client_no_cookies():
     tear_down(app_context)
 
 
+@pytest.fixture()
+def count_queries():
+    """ Context manager that records the SQL statements run inside it. """
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+    return counter
+
+
 @pytest.fixture()
 def selenium_driver():
     driver = webdriver.Firefox()
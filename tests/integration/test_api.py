@@ -1,7 +1,8 @@
 from base64 import b64encode
 import json
+from flask import current_app
 from flasky.app import db
-from flasky.app.models import User, Role
+from flasky.app.models import Post, User, Role
 
 
 def get_api_headers(username, password):
@@ -51,3 +52,197 @@ def test_posts(client_no_cookies):
     assert response.status_code == 200
     json_response = json.loads(response.get_data(as_text=True))
     assert json_response["body_html"] == "<p>body of the <em>blog</em> post</p>"
+
+
+def add_posts_for_pagination(count):
+    email = "john@example.com"
+    password = "cat"
+    user = User(email=email, password=password, confirmed=True)
+    db.session.add(user)
+    db.session.commit()
+    for ii in range(count):
+        db.session.add(Post(body=f"post {ii}", author=user))
+    db.session.commit()
+    return get_api_headers(email, password)
+
+
+def test_cursor_pagination(client_no_cookies):
+    current_app.config["FLASKY_POSTS_PER_PAGE"] = 2
+    headers = add_posts_for_pagination(5)
+
+    # Walk forward through every page
+    response = client_no_cookies.get("/api/v1/posts/?cursor=", headers=headers)
+    assert response.status_code == 200
+    json_response = response.get_json()
+    assert json_response["count"] is None
+    assert json_response["prev"] is None
+    bodies = [p["body"] for p in json_response["posts"]]
+    pages = [json_response]
+    while json_response["next"] is not None:
+        json_response = client_no_cookies.get(
+            json_response["next"], headers=headers).get_json()
+        bodies.extend(p["body"] for p in json_response["posts"])
+        pages.append(json_response)
+    assert bodies == [f"post {ii}" for ii in range(5)]
+    assert len(pages) == 3
+
+    # And back from the last page
+    json_response = client_no_cookies.get(
+        pages[-1]["prev"], headers=headers).get_json()
+    assert [p["body"] for p in json_response["posts"]] == ["post 2", "post 3"]
+
+
+def test_cursor_pagination_count_and_invalid_cursor(client_no_cookies):
+    headers = add_posts_for_pagination(3)
+    response = client_no_cookies.get(
+        "/api/v1/posts/?cursor=&count=true", headers=headers)
+    assert response.get_json()["count"] == 3
+
+    response = client_no_cookies.get(
+        "/api/v1/posts/?cursor=garbage", headers=headers)
+    assert response.status_code == 400
+
+
+def test_page_pagination(client_no_cookies):
+    current_app.config["FLASKY_POSTS_PER_PAGE"] = 2
+    headers = add_posts_for_pagination(5)
+    response = client_no_cookies.get("/api/v1/posts/?page=2", headers=headers)
+    json_response = response.get_json()
+    assert [p["body"] for p in json_response["posts"]] == ["post 2", "post 3"]
+    assert json_response["count"] == 5
+    assert "page=1" in json_response["prev"]
+    assert "page=3" in json_response["next"]
+
+
+def test_credential_cache(client_no_cookies, monkeypatch):
+    headers = add_posts_for_pagination(0)
+    checks = []
+    verify_password = User.verify_password
+
+    def counting_verify_password(self, password):
+        checks.append(password)
+        return verify_password(self, password)
+
+    monkeypatch.setattr(User, "verify_password", counting_verify_password)
+    for _ in range(3):
+        response = client_no_cookies.get("/api/v1/posts/", headers=headers)
+        assert response.status_code == 200
+    assert len(checks) == 1
+
+    # Wrong passwords are never cached
+    bad_headers = get_api_headers("john@example.com", "dog")
+    for _ in range(2):
+        response = client_no_cookies.get("/api/v1/posts/", headers=bad_headers)
+        assert response.status_code == 401
+    assert len(checks) == 3
+
+    # Changing the password invalidates the cached check
+    user = User.query.filter_by(email="john@example.com").first()
+    user.password = "dog"
+    db.session.commit()
+    response = client_no_cookies.get("/api/v1/posts/", headers=headers)
+    assert response.status_code == 401
+    response = client_no_cookies.get("/api/v1/posts/", headers=bad_headers)
+    assert response.status_code == 200
+
+
+def test_token_authentication(client_no_cookies, count_queries):
+    headers = add_posts_for_pagination(1)
+    response = client_no_cookies.post("/api/v1/tokens/", headers=headers)
+    assert response.status_code == 200
+    token = response.get_json()["token"]
+
+    token_headers = get_api_headers(token, "")
+    db.session.expire_all()
+    with count_queries() as statements:
+        response = client_no_cookies.get("/api/v1/posts/", headers=token_headers)
+    assert response.status_code == 200
+    assert not [s for s in statements if "FROM users" in s]
+
+    # Write with the token, which also goes through permission_required
+    response = client_no_cookies.post(
+        "/api/v1/posts/", headers=token_headers,
+        data=json.dumps({"body": "posted with a token"})
+    )
+    assert response.status_code == 201
+    post_url = response.headers["Location"]
+    response = client_no_cookies.put(
+        post_url, headers=token_headers,
+        data=json.dumps({"body": "edited with a token"})
+    )
+    assert response.status_code == 200
+    assert response.get_json()["body"] == "edited with a token"
+
+    # Tokens can't be used to get new tokens, nor are other tokens accepted
+    response = client_no_cookies.post("/api/v1/tokens/", headers=token_headers)
+    assert response.status_code == 401
+    user = User.query.filter_by(email="john@example.com").first()
+    confirmation_headers = get_api_headers(user.generate_confirmation_token(), "")
+    response = client_no_cookies.get("/api/v1/posts/", headers=confirmation_headers)
+    assert response.status_code == 401
+
+
+def test_conditional_get_post(client_no_cookies):
+    add_posts_for_pagination(1)
+    headers = get_api_headers("john@example.com", "cat")
+    post = Post.query.first()
+    response = client_no_cookies.get(f"/api/v1/posts/{post.id}", headers=headers)
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+
+    response = client_no_cookies.get(f"/api/v1/posts/{post.id}",
+                                     headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    response = client_no_cookies.get(f"/api/v1/posts/{post.id}",
+                                     headers={**headers, "If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+    client_no_cookies.put(f"/api/v1/posts/{post.id}", headers=headers,
+                          data=json.dumps({"body": "edited"}))
+    response = client_no_cookies.get(f"/api/v1/posts/{post.id}",
+                                     headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_conditional_get_timeline(client_no_cookies):
+    add_posts_for_pagination(3)
+    headers = get_api_headers("john@example.com", "cat")
+    user = User.query.filter_by(email="john@example.com").first()
+    url = f"/api/v1/users/{user.id}/timeline/"
+    etag = client_no_cookies.get(url, headers=headers).headers["ETag"]
+    response = client_no_cookies.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    # A new post and a deleted one both change the collection
+    client_no_cookies.post("/api/v1/posts/", headers=headers,
+                           data=json.dumps({"body": "new post"}))
+    response = client_no_cookies.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    db.session.delete(Post.query.first())
+    db.session.commit()
+    response = client_no_cookies.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.get_json()["posts"]) == 3
+
+
+def test_collection_not_modified_costs_the_page_query(client_no_cookies, count_queries):
+    add_posts_for_pagination(30)
+    headers = get_api_headers("john@example.com", "cat")
+    url = "/api/v1/posts/?cursor="
+    etag = client_no_cookies.get(url, headers=headers).headers["ETag"]
+    with count_queries() as statements:
+        response = client_no_cookies.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    # The user lookup and the keyset page, no COUNT or MAX over the table
+    assert len(statements) == 2
+    assert not any("count(" in s or "max(" in s for s in statements)
+
+    # Editing a post on the page changes its ETag
+    post = Post.query.order_by(Post.timestamp, Post.id).first()
+    post.body = "edited"
+    db.session.commit()
+    response = client_no_cookies.get(url, headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
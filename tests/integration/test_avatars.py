@@ -0,0 +1,48 @@
+import struct
+from flask import current_app
+from flasky.app import db
+from flasky.app.avatars import identicon
+from flasky.app.models import User
+
+HASH = "d4c74594d841139328695756648b6bd6"
+
+
+def png_size(data):
+    assert data.startswith(b"\x89PNG\r\n\x1a\n")
+    return struct.unpack(">II", data[16:24])
+
+
+def test_identicon_is_deterministic():
+    assert identicon(HASH, 40) == identicon(HASH, 40)
+    assert identicon(HASH, 40) != identicon("0" * 32, 40)
+    assert png_size(identicon(HASH, 40)) == (40, 40)
+
+
+def test_avatar_route(client_no_cookies, tmp_path):
+    current_app.config["FLASKY_AVATAR_CACHE_DIR"] = str(tmp_path)
+    db.session.add(User(email="john@example.com", password="cat"))
+    db.session.commit()
+    response = client_no_cookies.get(f"/avatar/{HASH}?s=64")
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.cache_control.immutable
+    assert png_size(response.get_data()) == (64, 64)
+    assert len(list(tmp_path.glob("*/*.png"))) == 1
+
+    # Served again from the disk cache, and sizes are snapped
+    assert client_no_cookies.get(f"/avatar/{HASH}?s=64").get_data() == response.get_data()
+    response = client_no_cookies.get(f"/avatar/{HASH}?s=100000")
+    assert png_size(response.get_data()) == (512, 512)
+    response = client_no_cookies.get(f"/avatar/{HASH}?s=265")
+    assert png_size(response.get_data()) == (256, 256)
+    assert len(list(tmp_path.glob("*/*.png"))) == 3
+    assert client_no_cookies.get("/avatar/not-a-hash").status_code == 404
+
+
+def test_unknown_hashes_are_not_stored(client_no_cookies, tmp_path):
+    current_app.config["FLASKY_AVATAR_CACHE_DIR"] = str(tmp_path)
+    response = client_no_cookies.get(f"/avatar/{'0' * 32}?s=40")
+    assert response.status_code == 200
+    assert png_size(response.get_data()) == (40, 40)
+    assert list(tmp_path.glob("*/*.png")) == []
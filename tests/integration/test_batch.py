@@ -0,0 +1,60 @@
+import json
+from flask import current_app
+from flasky.app.models import Comment, Post
+from tests.integration.test_api import add_posts_for_pagination
+
+
+def test_multi_get_posts(client_no_cookies, count_queries):
+    headers = add_posts_for_pagination(5)
+    with count_queries() as statements:
+        response = client_no_cookies.get("/api/v1/posts/?ids=4,2,99,4", headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [post["body"] for post in data["posts"]] == ["post 3", "post 1"]
+    assert data["missing"] == [99]
+    assert len([s for s in statements if "FROM posts" in s]) == 1
+
+
+def test_multi_get_users_and_comments(client_no_cookies):
+    headers = add_posts_for_pagination(1)
+    response = client_no_cookies.get("/api/v1/users/?ids=1", headers=headers)
+    assert response.get_json()["users"][0]["post_count"] == 1
+    assert client_no_cookies.get("/api/v1/users/", headers=headers).status_code == 400
+    response = client_no_cookies.get("/api/v1/comments/?ids=1", headers=headers)
+    assert response.get_json() == {"comments": [], "missing": [1]}
+    response = client_no_cookies.get("/api/v1/comments/?ids=one", headers=headers)
+    assert response.status_code == 400
+
+
+def test_batch_create_posts(client_no_cookies):
+    headers = add_posts_for_pagination(0)
+    response = client_no_cookies.post(
+        "/api/v1/posts/batch", headers=headers,
+        data=json.dumps({"posts": [{"body": "first"}, {"body": ""}, {"body": "*second*"}]}))
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [result["status"] for result in results] == [201, 400, 201]
+    assert results[2]["post"]["body_html"] == "<p><em>second</em></p>"
+    assert Post.query.count() == 2
+
+
+def test_batch_create_comments(client_no_cookies):
+    headers = add_posts_for_pagination(1)
+    response = client_no_cookies.post(
+        "/api/v1/comments/batch", headers=headers,
+        data=json.dumps([{"post_id": 1, "body": "nice"}, {"post_id": 2, "body": "lost"}]))
+    results = response.get_json()["results"]
+    assert [result["status"] for result in results] == [201, 404]
+    assert Comment.query.count() == 1
+    assert Post.query.first().comment_count == 1
+
+
+def test_batch_size_limit(client_no_cookies):
+    headers = add_posts_for_pagination(0)
+    current_app.config["FLASKY_API_MAX_BATCH"] = 2
+    response = client_no_cookies.post("/api/v1/posts/batch", headers=headers,
+                                      data=json.dumps([{"body": "post"}] * 3))
+    assert response.status_code == 400
+    response = client_no_cookies.get("/api/v1/posts/?ids=1,2,3", headers=headers)
+    assert response.status_code == 400
+    assert Post.query.count() == 0
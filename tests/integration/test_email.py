@@ -0,0 +1,140 @@
+import socketserver
+import threading
+import pytest
+from flask import current_app
+from flask_mail import Message
+from flasky.app import mail, mail_queue
+from flasky.app.email import MailQueue, send_email
+
+pytestmark = pytest.mark.usefixtures("set_up_flask_app")
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    """ Minimal SMTP stand-in that records connections and messages. """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+        self.fail_next = 0
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 localhost debugging server")
+        while True:
+            line = self.rfile.readline().decode("utf-8").strip()
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command in ("HELO", "EHLO"):
+                self.reply("250 localhost")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b".\r\n", b""):
+                        break
+                    data.append(data_line)
+                if server.fail_next:
+                    server.fail_next -= 1
+                    self.reply("451 Try again later")
+                else:
+                    server.messages.append(b"".join(data))
+                    self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("500 Unknown command")
+
+
+@pytest.fixture
+def smtp_server():
+    server = DebuggingSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    current_app.config.update(
+        MAIL_SERVER="127.0.0.1",
+        MAIL_PORT=server.server_address[1],
+        MAIL_USE_TLS=False,
+        MAIL_SUPPRESS_SEND=False,
+    )
+    mail.init_app(current_app)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_queue(**config):
+    queue = MailQueue()
+    queue.retries = config.get("retries", 3)
+    queue.backoff = 0.01
+    return queue
+
+
+def make_message(ii):
+    return Message(f"message {ii}", sender="flasky@example.com",
+                   recipients=["john@example.com"], body="body")
+
+
+def test_batch_is_sent_over_one_connection(smtp_server):
+    queue = make_queue()
+    sent = queue.deliver([(make_message(ii), 0) for ii in range(5)])
+    assert sent == 5
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 1
+    assert queue.stats()["sent"] == 5
+
+
+def test_transient_failures_are_retried(smtp_server):
+    smtp_server.fail_next = 1
+    queue = make_queue()
+    assert queue.deliver([(make_message(ii), 0) for ii in range(3)]) == 3
+    assert len(smtp_server.messages) == 3
+    assert queue.stats()["retried"] == 3
+    assert queue.stats()["failed"] == 0
+
+
+def test_gives_up_after_retries(smtp_server):
+    smtp_server.fail_next = 10
+    queue = make_queue(retries=2)
+    assert queue.deliver([(make_message(0), 0)]) == 0
+    assert smtp_server.connections == 3
+    assert queue.stats()["failed"] == 1
+
+
+def test_send_email_goes_through_worker_pool(smtp_server):
+    with current_app.test_request_context():
+        for _ in range(3):
+            assert send_email("john@example.com", "Hello", "mail/new_user",
+                              user="john")
+    mail_queue.join()
+    assert len(smtp_server.messages) == 3
+    assert mail_queue.stats()["queue_depth"] == 0
+    assert len(mail_queue._threads) == current_app.config["FLASKY_MAIL_WORKERS"]
+
+
+def test_join_times_out_on_undelivered_messages(smtp_server):
+    queue = make_queue()
+    queue.workers = 0
+    with current_app.app_context():
+        assert queue.enqueue(make_message(0))
+    assert not queue.join(timeout=0.05)
+
+    queue.workers = 1
+    with current_app.app_context():
+        queue.enqueue(make_message(1))
+    assert queue.join(timeout=5)
+    assert len(smtp_server.messages) == 2
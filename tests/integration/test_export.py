@@ -0,0 +1,60 @@
+import datetime
+import json
+from flask import current_app
+from flasky.app import db
+from flasky.app.models import Comment, Post, Role, User
+from tests.integration.test_api import get_api_headers
+
+
+def add_admin_with_posts(count):
+    admin = User(email="john@example.com", username="john", password="cat", confirmed=True,
+                 role=Role.query.filter_by(name="Administrator").first())
+    user = User(email="susan@example.com", username="susan", password="dog", confirmed=True)
+    db.session.add_all([admin, user])
+    for ii in range(count):
+        post = Post(body=f"post {ii}", author=admin)
+        db.session.add_all([post, Comment(body=f"comment {ii}", author=user, post=post)])
+    db.session.commit()
+
+
+def export(client, url, email="john@example.com", password="cat"):
+    response = client.get(url, headers=get_api_headers(email, password))
+    assert response.mimetype == "application/x-ndjson"
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_export_requires_admin(client_no_cookies):
+    add_admin_with_posts(1)
+    response = client_no_cookies.get("/api/v1/export/posts",
+                                     headers=get_api_headers("susan@example.com", "dog"))
+    assert response.status_code == 403
+
+
+def test_export_in_batches(client_no_cookies, count_queries):
+    add_admin_with_posts(5)
+    current_app.config["FLASKY_EXPORT_BATCH_SIZE"] = 2
+    with count_queries() as statements:
+        posts = export(client_no_cookies, "/api/v1/export/posts")
+    assert [post["id"] for post in posts] == [1, 2, 3, 4, 5]
+    assert posts[0]["body"] == "post 0"
+    assert len([s for s in statements if "FROM posts" in s]) == 3
+
+    comments = export(client_no_cookies, "/api/v1/export/comments")
+    assert len(comments) == 5
+    # Everyone follows themselves
+    follows = export(client_no_cookies, "/api/v1/export/follows")
+    assert {(f["follower_id"], f["followed_id"]) for f in follows} == {(1, 1), (2, 2)}
+
+
+def test_export_updated_since(client_no_cookies):
+    add_admin_with_posts(3)
+    since = datetime.datetime.utcnow()
+    post = db.session.get(Post, 2)
+    post.body = "edited"
+    db.session.commit()
+    posts = export(client_no_cookies,
+                   f"/api/v1/export/posts?updated_since={since.isoformat()}")
+    assert [p["body"] for p in posts] == ["edited"]
+    response = client_no_cookies.get("/api/v1/export/posts?updated_since=yesterday",
+                                     headers=get_api_headers("john@example.com", "cat"))
+    assert response.status_code == 400
@@ -0,0 +1,41 @@
+from flasky.app import db, fragment_cache
+from flasky.app.models import Comment, Post, Role, User
+
+
+def add_post_with_comment():
+    moderator = User(email="john@example.com", username="john", password="cat",
+                     confirmed=True, role=Role.query.filter_by(name="Moderator").first())
+    post = Post(body="the *post*", author=moderator)
+    comment = Comment(body="a comment", author=moderator, post=post)
+    db.session.add_all([moderator, post, comment])
+    db.session.commit()
+    return post, comment
+
+
+def test_cached_fragments_match_uncached(client_no_cookies):
+    post, _ = add_post_with_comment()
+    fragment_cache.clear()
+    fragment_cache.enabled = False
+    uncached = client_no_cookies.get(f"/post/{post.id}").get_data(as_text=True)
+    fragment_cache.enabled = True
+    first = client_no_cookies.get(f"/post/{post.id}").get_data(as_text=True)
+    hits = fragment_cache.stats()["hits"]
+    second = client_no_cookies.get(f"/post/{post.id}").get_data(as_text=True)
+    assert uncached == first == second
+    # The thumbnail and the content of the post and of the comment
+    assert fragment_cache.stats()["hits"] == hits + 4
+
+
+def test_edit_and_disable_render_new_fragments(client):
+    post, comment = add_post_with_comment()
+    client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+    assert "<em>post</em>" in client.get(f"/post/{post.id}").get_data(as_text=True)
+
+    client.post(f"/edit/{post.id}", data={"body": "the **edited** post"})
+    response = client.get(f"/post/{post.id}").get_data(as_text=True)
+    assert "<strong>edited</strong>" in response
+
+    client.get(f"/moderate/disable/{comment.id}")
+    response = client.get(f"/post/{post.id}").get_data(as_text=True)
+    assert "disabled by a moderator" in response
+    assert "a comment" not in response
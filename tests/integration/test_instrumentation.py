@@ -0,0 +1,85 @@
+import json
+from flask import current_app
+import pytest
+from flasky.app import db
+from flasky.app.instrumentation import QueryBudgetExceeded, aggregate_slow_queries
+from flasky.app.models import User
+from tests.integration.test_query_counts import add_posts_with_comments
+
+
+def test_no_server_timing_by_default(client_no_cookies):
+    response = client_no_cookies.get("/")
+    assert "Server-Timing" not in response.headers
+
+
+def test_server_timing_reports_queries(client_no_cookies, count_queries):
+    add_posts_with_comments(5)
+    current_app.config["FLASKY_SQL_INSTRUMENTATION"] = True
+    with count_queries() as statements:
+        response = client_no_cookies.get("/")
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("db;dur=")
+    assert f'desc="{len(statements)} queries, 0 duplicates"' in timing
+    assert "app;dur=" in timing
+
+
+def test_query_budget_fails_request(client_no_cookies):
+    add_posts_with_comments(5)
+    current_app.config["FLASKY_SQL_INSTRUMENTATION"] = True
+    current_app.config["FLASKY_SQL_QUERY_BUDGETS"] = {"main.index": 1}
+    with pytest.raises(QueryBudgetExceeded):
+        client_no_cookies.get("/")
+    response = client_no_cookies.get("/auth/login")
+    assert response.status_code == 200
+
+
+def test_slow_queries_are_logged_with_plan(client_no_cookies, caplog):
+    add_posts_with_comments(5)
+    current_app.config["FLASKY_SLOW_DB_QUERY_TIME"] = 0
+    with caplog.at_level("WARNING", logger="flasky.app.instrumentation.slow_queries"):
+        client_no_cookies.get("/")
+    entries = [json.loads(record.message) for record in caplog.records]
+    posts = [entry for entry in entries if "FROM posts" in entry["statement"]]
+    assert posts and all(entry["endpoint"] == "main.index" for entry in posts)
+    assert any("SCAN" in row[-1] for row in posts[0]["plan"])
+
+
+def test_slow_query_parameters_are_left_out(client_no_cookies, caplog):
+    current_app.config["FLASKY_SLOW_DB_QUERY_TIME"] = 0
+    with caplog.at_level("WARNING", logger="flasky.app.instrumentation.slow_queries"):
+        db.session.execute(db.insert(User.__table__), [
+            {"email": f"user{ii}@example.com", "password_hash": "secret hash"}
+            for ii in range(3)
+        ])
+        client_no_cookies.post("/auth/login", data={"email": "john@example.com",
+                                                    "password": "cat"})
+    entries = [json.loads(record.message) for record in caplog.records]
+    inserts = [entry for entry in entries if entry["statement"].startswith("INSERT INTO users")]
+    assert [entry["parameters"] for entry in inserts] == [{"rows": 3}]
+    assert all(entry["parameters"] is None for entry in entries if entry not in inserts)
+    assert "example.com" not in caplog.text and "secret hash" not in caplog.text
+
+    current_app.config["FLASKY_SLOW_QUERY_LOG_PARAMETERS"] = True
+    caplog.clear()
+    with caplog.at_level("WARNING", logger="flasky.app.instrumentation.slow_queries"):
+        db.session.execute(db.select(User.id).where(User.email == "x" * 100))
+    entry = json.loads(caplog.records[0].message)
+    assert entry["parameters"] == ["x" * 64 + "..."]
+
+
+def test_aggregate_slow_queries():
+    lines = [json.dumps({"statement": statement, "duration": duration,
+                         "endpoint": "main.post", "plan": None})
+             for statement, duration in [
+                 ("SELECT * FROM posts WHERE id IN (?, ?, ?)", 1.0),
+                 ("SELECT * FROM posts  WHERE id IN (?, ?)", 2.0),
+                 ("SELECT * FROM users WHERE id = 5", 0.5),
+             ]]
+    groups = aggregate_slow_queries(lines + ["not json"])
+    assert [group["statement"] for group in groups] == [
+        "SELECT * FROM posts WHERE id IN (?)",
+        "SELECT * FROM users WHERE id = ?",
+    ]
+    assert groups[0]["count"] == 2 and groups[0]["total"] == 3.0
+    assert groups[0]["max"] == 2.0
+    assert groups[0]["endpoints"] == {"main.post": 2}
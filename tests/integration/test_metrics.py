@@ -0,0 +1,58 @@
+from flask import current_app
+from flasky.app import db
+from flasky.app.metrics import Histogram
+from flasky.app.models import Role, User
+
+
+def add_user(email, role_name="User"):
+    user = User(email=email, username=email.split("@")[0], password="cat",
+                confirmed=True, role=Role.query.filter_by(name=role_name).first())
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def login(client, email):
+    return client.post("/auth/login", data={"email": email, "password": "cat"})
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert list(histogram.cumulative()) == [(0.1, 2), (1.0, 3), (float("inf"), 4)]
+    assert histogram.count == 4
+
+
+def test_metrics_require_admin(client):
+    assert client.get("/metrics").status_code == 302
+    add_user("susan@example.com")
+    login(client, "susan@example.com")
+    assert client.get("/metrics").status_code == 403
+
+
+def test_metrics_by_endpoint(client):
+    add_user("john@example.com", "Administrator")
+    login(client, "john@example.com")
+    client.get("/")
+    client.get("/post/12345")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    text = response.get_data(as_text=True)
+    assert 'flasky_request_duration_seconds_count{endpoint="main.index"}' in text
+    assert 'flasky_requests_total{endpoint="main.post",status="404"}' in text
+    assert 'flasky_requests_in_flight 1' in text
+    assert 'flasky_cache_requests_total{cache="render",result="hit"}' in text
+    assert 'flasky_mail_queue_depth 0' in text
+    assert 'flasky_mail_messages_total{result="dropped"}' in text
+    assert 'flasky_mail_delivery_seconds_count' in text
+
+
+def test_metrics_not_found_when_disabled(client, monkeypatch):
+    monkeypatch.delitem(current_app.extensions, "metrics")
+    add_user("john@example.com", "Administrator")
+    login(client, "john@example.com")
+    response = client.get("/metrics")
+    assert response.status_code == 404
+    assert response.content_type.startswith("text/html")
@@ -0,0 +1,136 @@
+import json
+from flask import current_app
+import pytest
+from flasky.app import db, page_cache
+from flasky.app.models import Comment, Post, User
+from tests.integration.test_api import get_api_headers
+
+
+@pytest.fixture()
+def cached_client(client):
+    current_app.config["FLASKY_PAGE_CACHE"] = True
+    page_cache.clear()
+    user = User(email="john@example.com", username="john", password="cat",
+                confirmed=True)
+    db.session.add(Post(body="first post", author=user))
+    db.session.commit()
+    yield client
+    page_cache.join()
+
+
+def test_anonymous_pages_are_cached(cached_client):
+    assert cached_client.get("/").headers["X-Page-Cache"] == "miss"
+    assert cached_client.get("/").headers["X-Page-Cache"] == "hit"
+    assert cached_client.get("/?page=2").headers["X-Page-Cache"] == "miss"
+    assert cached_client.get("/user/john").headers["X-Page-Cache"] == "miss"
+    assert cached_client.get("/user/john").headers["X-Page-Cache"] == "hit"
+
+
+def test_logged_in_users_skip_the_cache(cached_client):
+    cached_client.get("/")
+    cached_client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+    assert "X-Page-Cache" not in cached_client.get("/").headers
+
+
+def test_new_post_serves_stale_page_while_refreshing(cached_client):
+    cached_client.get("/")
+    response = cached_client.post("/api/v1/posts/",
+                                  headers=get_api_headers("john@example.com", "cat"),
+                                  data=json.dumps({"body": "second post"}))
+    assert response.status_code == 201
+
+    response = cached_client.get("/")
+    assert response.headers["X-Page-Cache"] == "stale"
+    assert "second post" not in response.get_data(as_text=True)
+    page_cache.join()
+    response = cached_client.get("/")
+    assert response.headers["X-Page-Cache"] == "hit"
+    assert "second post" in response.get_data(as_text=True)
+
+
+def test_profile_change_invalidates_only_that_profile(cached_client):
+    cached_client.get("/")
+    cached_client.get("/user/john")
+    user = User.query.filter_by(username="john").first()
+    user.location = "Springfield"
+    db.session.commit()
+    assert cached_client.get("/").headers["X-Page-Cache"] == "hit"
+    assert cached_client.get("/user/john").headers["X-Page-Cache"] == "stale"
+
+
+def test_expired_pages_are_rendered_again(cached_client):
+    cached_client.get("/")
+    current_app.config["FLASKY_PAGE_CACHE_TTL"] = 0
+    assert cached_client.get("/").headers["X-Page-Cache"] == "stale"
+    page_cache.join()
+    current_app.config["FLASKY_PAGE_CACHE_MAX_STALE"] = 0
+    assert cached_client.get("/").headers["X-Page-Cache"] == "miss"
+
+
+def test_new_comment_invalidates_cached_pages(cached_client):
+    assert "0 Comments" in cached_client.get("/").get_data(as_text=True)
+    # Only the post's counter changes, with a plain UPDATE
+    db.session.add(Comment(body="a comment", post_id=1, author_id=1))
+    db.session.commit()
+    assert cached_client.get("/").headers["X-Page-Cache"] == "stale"
+    page_cache.join()
+    response = cached_client.get("/")
+    assert response.headers["X-Page-Cache"] == "hit"
+    assert "1 Comments" in response.get_data(as_text=True)
+
+
+def test_rollback_discards_pending_invalidations(cached_client):
+    cached_client.get("/")
+    db.session.add(Post(body="second post", author_id=1))
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    assert cached_client.get("/").headers["X-Page-Cache"] == "hit"
+
+
+def test_savepoint_rollback_keeps_pending_invalidations(cached_client):
+    cached_client.get("/")
+    db.session.add(Post(body="second post", author_id=1))
+    db.session.flush()
+    savepoint = db.session.begin_nested()
+    db.session.add(Comment(body="a comment", post_id=1, author_id=1))
+    db.session.flush()
+    savepoint.rollback()
+    db.session.commit()
+    assert cached_client.get("/").headers["X-Page-Cache"] == "stale"
+
+
+def test_follow_invalidates_both_profiles(cached_client):
+    susan = User(email="susan@example.com", username="susan", password="dog",
+                 confirmed=True)
+    db.session.add(susan)
+    db.session.commit()
+    for url in ("/", "/user/john", "/user/susan"):
+        cached_client.get(url)
+    susan.follow(User.query.filter_by(username="john").first())
+    db.session.commit()
+    assert cached_client.get("/").headers["X-Page-Cache"] == "hit"
+    assert cached_client.get("/user/john").headers["X-Page-Cache"] == "stale"
+    assert cached_client.get("/user/susan").headers["X-Page-Cache"] == "stale"
+
+
+def test_refresh_keeps_the_url_root(cached_client):
+    base_url = "https://flasky.example.com/blog/"
+    cached_client.get("/", base_url=base_url)
+    page_cache.invalidate()
+    cached_client.get("/", base_url=base_url)
+    page_cache.join()
+    response = cached_client.get("/", base_url=base_url)
+    assert response.headers["X-Page-Cache"] == "hit"
+    assert 'href="/blog/user/john"' in response.get_data(as_text=True)
+
+
+def test_pages_are_cached_per_url_root(cached_client):
+    assert cached_client.get("/user/john").headers["X-Page-Cache"] == "miss"
+    response = cached_client.get("/user/john", base_url="https://localhost/")
+    assert response.headers["X-Page-Cache"] == "miss"
+    assert "https://secure.gravatar.com/avatar/" in response.get_data(as_text=True)
+    assert "http://gravatar.com/avatar/" not in response.get_data(as_text=True)
+    response = cached_client.get("/user/john", base_url="http://localhost/blog/")
+    assert response.headers["X-Page-Cache"] == "miss"
+    assert cached_client.get("/user/john").headers["X-Page-Cache"] == "hit"
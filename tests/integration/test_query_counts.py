@@ -0,0 +1,76 @@
+from flask import current_app
+from flasky.app import db
+from flasky.app.models import Comment, Post, User
+from tests.integration.test_api import get_api_headers
+
+
+def add_posts_with_comments(count):
+    user = User(email="john@example.com", username="john",
+                password="cat", confirmed=True)
+    db.session.add(user)
+    for ii in range(count):
+        post = Post(body=f"post {ii}", author=user)
+        db.session.add(post)
+        db.session.add(Comment(body="comment", author=user, post=post))
+    db.session.commit()
+
+
+def queries_for_page(client, count_queries, url, page_size, headers=None):
+    current_app.config["FLASKY_POSTS_PER_PAGE"] = page_size
+    db.session.expire_all()
+    with count_queries() as statements:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_index_comment_counts_are_batched(client_no_cookies, count_queries):
+    add_posts_with_comments(20)
+    small = queries_for_page(client_no_cookies, count_queries, "/", 5)
+    large = queries_for_page(client_no_cookies, count_queries, "/", 20)
+    assert small == large
+
+
+def test_api_comment_counts_are_batched(client_no_cookies, count_queries):
+    add_posts_with_comments(20)
+    headers = get_api_headers("john@example.com", "cat")
+    small = queries_for_page(
+        client_no_cookies, count_queries, "/api/v1/posts/", 5, headers)
+    large = queries_for_page(
+        client_no_cookies, count_queries, "/api/v1/posts/", 20, headers)
+    assert small == large
+    response = client_no_cookies.get("/api/v1/posts/", headers=headers)
+    assert all(p["comment_count"] == 1 for p in response.get_json()["posts"])
+
+
+def add_posts_by_distinct_authors(count):
+    post = None
+    for ii in range(count):
+        author = User(email=f"user{ii}@example.com", username=f"user{ii}",
+                      password="cat", confirmed=True)
+        post = Post(body=f"post {ii}", author=author)
+        db.session.add(post)
+        db.session.add(Comment(body="comment", author=author, post=post))
+    db.session.commit()
+    return post
+
+
+def test_index_authors_are_eager_loaded(client_no_cookies, count_queries):
+    add_posts_by_distinct_authors(20)
+    small = queries_for_page(client_no_cookies, count_queries, "/", 5)
+    large = queries_for_page(client_no_cookies, count_queries, "/", 20)
+    assert small == large
+
+
+def test_post_comment_authors_are_eager_loaded(client_no_cookies, count_queries):
+    post = add_posts_by_distinct_authors(1)
+    url = f"/post/{post.id}"
+    few = queries_for_page(client_no_cookies, count_queries, url, 20)
+
+    for ii in range(20):
+        author = User(email=f"commenter{ii}@example.com",
+                      username=f"commenter{ii}", password="cat")
+        db.session.add(Comment(body="comment", author=author, post=post))
+    db.session.commit()
+    many = queries_for_page(client_no_cookies, count_queries, url, 20)
+    assert few == many
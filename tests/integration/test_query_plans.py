@@ -0,0 +1,90 @@
+import json
+from flask import current_app
+import pytest
+from flasky.app import db
+from flasky.app.models import Comment, Post, Role, Timeline, User
+from tests.integration.test_api import get_api_headers
+
+
+@pytest.fixture()
+def explained(client_no_cookies, caplog):
+    """ Returns a function that requests a URL and returns the query plans
+        of the statements it ran, captured by the slow query log.
+    """
+    john = User(email="john@example.com", username="john", password="cat", confirmed=True)
+    susan = User(email="susan@example.com", username="susan", password="dog", confirmed=True)
+    db.session.add_all([john, susan])
+    db.session.commit()
+    susan.follow(john)
+    for ii in range(3):
+        post = Post(body=f"post {ii}", author=john)
+        db.session.add_all([post, Comment(body="comment", author=susan, post=post)])
+    db.session.commit()
+    current_app.config["FLASKY_SLOW_DB_QUERY_TIME"] = 0
+
+    def get(url, table, headers=None, client=client_no_cookies):
+        caplog.clear()
+        with caplog.at_level("WARNING", logger="flasky.app.instrumentation.slow_queries"):
+            response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        plans = [" | ".join(row[-1] for row in entry["plan"])
+                 for entry in map(json.loads, caplog.messages)
+                 if entry["plan"] and f"FROM {table}" in entry["statement"]]
+        assert plans
+        return plans
+    return get
+
+
+def assert_uses(plans, index):
+    for plan in plans:
+        assert index in plan, plan
+        assert "TEMP B-TREE" not in plan, plan
+
+
+def test_user_posts_use_author_index(explained):
+    assert_uses(explained("/user/john", "posts"), "ix_posts_author_id_timestamp")
+    headers = get_api_headers("john@example.com", "cat")
+    for url in ("/api/v1/users/1/posts/", "/api/v1/users/1/posts/?cursor="):
+        assert_uses(explained(url, "posts", headers), "ix_posts_author_id_timestamp")
+
+
+def test_post_comments_use_post_index(explained):
+    assert_uses(explained("/post/1", "comments"), "ix_comments_post_id_timestamp")
+    headers = get_api_headers("john@example.com", "cat")
+    assert_uses(explained("/api/v1/posts/1/comments/?cursor=", "comments", headers),
+                "ix_comments_post_id_timestamp")
+
+
+def test_followers_use_reverse_follow_index(explained):
+    assert_uses(explained("/followers/john", "follows"),
+                "ix_follows_followed_id_follower_id")
+
+
+def test_followed_posts_use_author_index(explained):
+    headers = get_api_headers("susan@example.com", "dog")
+    for plan in explained("/api/v1/users/2/timeline/", "posts", headers):
+        # The posts of each followed author come from a range of the
+        # author index, merging the authors needs one sort
+        assert "SEARCH follows" in plan, plan
+        assert "ix_posts_author_id_timestamp (author_id=?)" in plan, plan
+        assert "SCAN posts" not in plan, plan
+
+
+def test_materialized_timeline_needs_no_sort(explained):
+    current_app.config["FLASKY_MATERIALIZED_TIMELINES"] = True
+    Timeline.rebuild()
+    headers = get_api_headers("susan@example.com", "dog")
+    assert_uses(explained("/api/v1/users/2/timeline/?cursor=", "posts", headers),
+                "ix_timelines_user_id_timestamp_post_id")
+
+
+def test_moderated_comments_use_timestamp_index(explained):
+    john = User.query.filter_by(username="john").first()
+    john.role = Role.query.filter_by(name="Administrator").first()
+    db.session.commit()
+    client = current_app.test_client(use_cookies=True)
+    client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+    page, count = explained("/moderate", "comments", client=client)
+    assert_uses([page], "ix_comments_timestamp")
+    # Counting every comment may read any of the table's indexes
+    assert "COVERING INDEX" in count, count
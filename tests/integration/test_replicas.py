@@ -0,0 +1,115 @@
+import shutil
+import pytest
+from flask import current_app
+from flasky.app import create_app, db, page_cache
+from flasky.app.models import Post, Role, User
+from flasky.config import config, TestingConfig
+from tests.integration.test_api import get_api_headers
+
+
+@pytest.fixture()
+def replicated(tmp_path):
+    """ App whose replica is a copy of the primary database file. Returns
+        a function that adds a post straight to one of the two files.
+    """
+    primary = tmp_path / "primary.sqlite"
+    replica = tmp_path / "replica.sqlite"
+
+    class ReplicatedConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{primary}"
+        SQLALCHEMY_BINDS = {"replica": f"sqlite:///{replica}"}
+        FLASKY_DB_REPLICAS = ["replica"]
+
+    config["replicated"] = ReplicatedConfig
+    app = create_app("replicated")
+    context = app.app_context()
+    context.push()
+    db.create_all()
+    Role.insert_roles()
+    db.session.add_all([
+        User(email="john@example.com", username="john", password="cat", confirmed=True),
+        User(email="susan@example.com", username="susan", password="dog", confirmed=True),
+    ])
+    db.session.commit()
+    db.session.remove()
+    for engine in db.engines.values():
+        engine.dispose()
+    shutil.copy(primary, replica)
+
+    def add_post(body, bind=None):
+        with db.engines[bind].begin() as conn:
+            conn.execute(db.insert(Post).values(body=body, body_html=body, author_id=1))
+
+    yield add_post
+    db.session.remove()
+    context.pop()
+    del config["replicated"]
+    # init_app registered a metadata for the bind on the shared db
+    db.metadatas.pop("replica")
+
+
+def post_bodies(client, email, password):
+    response = client.get("/api/v1/posts/", headers=get_api_headers(email, password))
+    assert response.status_code == 200
+    return {post["body"] for post in response.get_json()["posts"]}
+
+
+def test_reads_use_replica_and_writes_primary(replicated):
+    replicated("replica only", bind="replica")
+    client = current_app.test_client(use_cookies=False)
+    assert post_bodies(client, "susan@example.com", "dog") == {"replica only"}
+
+    response = client.post("/api/v1/posts/", json={"body": "new post"},
+                           headers=get_api_headers("susan@example.com", "dog"))
+    assert response.status_code == 201
+    assert db.session.execute(db.select(Post.body)).scalars().all() == ["new post"]
+
+
+def test_writer_reads_primary_for_a_while(replicated):
+    client = current_app.test_client(use_cookies=False)
+    response = client.post("/api/v1/posts/", json={"body": "new post"},
+                           headers=get_api_headers("john@example.com", "cat"))
+    assert response.status_code == 201
+    assert post_bodies(client, "john@example.com", "cat") == {"new post"}
+    assert post_bodies(client, "susan@example.com", "dog") == set()
+    # The same user reading with a token also sees the write
+    token = client.post("/api/v1/tokens/",
+                        headers=get_api_headers("john@example.com", "cat")).get_json()["token"]
+    assert post_bodies(client, token, "") == {"new post"}
+
+    current_app.config["FLASKY_DB_PRIMARY_WINDOW"] = 0
+    client.post("/api/v1/posts/", json={"body": "another post"},
+                headers=get_api_headers("john@example.com", "cat"))
+    assert post_bodies(client, "john@example.com", "cat") == set()
+
+
+def test_get_views_that_write_use_primary(replicated):
+    with db.engines[None].begin() as conn:
+        conn.execute(db.insert(User).values(email="dave@example.com", username="dave",
+                                            confirmed=True, role_id=1))
+    client = current_app.test_client(use_cookies=True)
+    client.post("/auth/login", data={"email": "john@example.com", "password": "cat"})
+    response = client.get("/follow/dave")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/user/dave"
+
+
+def test_cached_pages_are_rendered_from_primary(replicated):
+    current_app.config["FLASKY_PAGE_CACHE"] = True
+    page_cache.clear()
+    replicated("first post")
+    client = current_app.test_client(use_cookies=False)
+    response = client.get("/")
+    assert response.headers["X-Page-Cache"] == "miss"
+    assert "first post" in response.get_data(as_text=True)
+
+    # The refresh after an invalidation doesn't read the lagging replica
+    replicated("second post")
+    page_cache.invalidate()
+    assert client.get("/").headers["X-Page-Cache"] == "stale"
+    page_cache.join()
+    response = client.get("/")
+    assert response.headers["X-Page-Cache"] == "hit"
+    assert "second post" in response.get_data(as_text=True)
+    # Uncached pages still read from the replica
+    assert post_bodies(client, "susan@example.com", "dog") == set()
@@ -0,0 +1,64 @@
+import pytest
+from flasky.app import db
+from flasky.app.models import Comment, Post, User, reconcile_counters
+
+pytestmark = pytest.mark.usefixtures("set_up_flask_app")
+
+
+def add_user_to_db(email, username):
+    user = User(email=email, username=username, password="cat")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_post_and_comment_counters():
+    user = add_user_to_db("john@example.com", "john")
+    post = Post(body="post", author=user)
+    db.session.add(post)
+    db.session.add_all([Comment(body="comment", author=user, post=post)
+                        for _ in range(3)])
+    db.session.commit()
+    assert user.post_count == 1
+    assert user.comment_count == 3
+    assert post.comment_count == 3
+
+    db.session.delete(post.comments.first())
+    db.session.commit()
+    assert user.comment_count == 2
+    assert post.comment_count == 2
+
+
+def test_follow_counters():
+    john = add_user_to_db("john@example.com", "john")
+    susan = add_user_to_db("susan@example.org", "susan")
+    # Users follow themselves
+    assert john.follower_count == 1
+    assert john.followed_count == 1
+
+    john.follow(susan)
+    db.session.commit()
+    assert john.followed_count == 2
+    assert susan.follower_count == 2
+
+    john.unfollow(susan)
+    db.session.commit()
+    assert john.followed_count == 1
+    assert susan.follower_count == 1
+
+
+def test_reconcile_counters_repairs_drift():
+    user = add_user_to_db("john@example.com", "john")
+    post = Post(body="post", author=user)
+    db.session.add(post)
+    db.session.commit()
+    db.session.execute(db.update(User).values(post_count=10, follower_count=0))
+    db.session.execute(db.update(Post).values(comment_count=3))
+    db.session.commit()
+
+    # A row with several drifted counters is counted once
+    assert reconcile_counters() == 2
+    assert user.post_count == 1
+    assert user.follower_count == 1
+    assert post.comment_count == 0
+    assert reconcile_counters() == 0
@@ -0,0 +1,50 @@
+import pytest
+from flasky.app import db
+from flasky.app.fake import add_comments, add_followers, add_posts, add_users, seed_db
+from flasky.app.models import Comment, Follow, Post, User, reconcile_counters
+
+pytestmark = pytest.mark.usefixtures("set_up_flask_app")
+
+
+def count(model):
+    return db.session.execute(db.select(db.func.count()).select_from(model)).scalar()
+
+
+def test_seed_db():
+    seed_db(users=30, posts=60, follows=150, comments=40, workers=1)
+    assert count(User) == 30
+    assert count(Post) == 60
+    assert count(Comment) == 40
+    # Every user follows itself on top of the generated graph
+    self_follows = db.session.execute(
+        db.select(db.func.count()).select_from(Follow)
+        .where(Follow.follower_id == Follow.followed_id)
+    ).scalar()
+    assert self_follows == 30
+    assert count(Follow) > 30
+
+    assert all(post.body_html for post in Post.query.limit(5))
+    # Counters were rebuilt after the bulk inserts
+    assert reconcile_counters() == 0
+    assert sum(user.post_count for user in User.query) == 60
+
+
+def test_seeding_skips_deleted_ids():
+    add_users(20, workers=1)
+    deleted = list(range(2, 20, 2))
+    db.session.execute(db.delete(User).where(User.id.in_(deleted)))
+    db.session.commit()
+    assert add_posts(40, workers=2) == 40
+    db.session.execute(db.delete(Post).where(Post.id.in_(deleted)))
+    db.session.commit()
+    assert add_followers(50, workers=2) > 0
+    assert add_comments(40, workers=2) == 40
+
+    users = set(db.session.execute(db.select(User.id)).scalars())
+    posts = set(db.session.execute(db.select(Post.id)).scalars())
+    assert set(db.session.execute(db.select(Post.author_id)).scalars()) <= users
+    assert set(db.session.execute(db.select(Comment.author_id)).scalars()) <= users
+    assert set(db.session.execute(db.select(Comment.post_id)).scalars()) <= posts
+    for follower_id, followed_id in db.session.execute(
+            db.select(Follow.follower_id, Follow.followed_id)):
+        assert follower_id in users and followed_id in users
@@ -39,3 +39,14 @@ def test_gravatar(set_up):
     assert 'r=pg' in gravatar_pg
     assert 'd=retro' in gravatar_retro
 
+
+@pytest.mark.usefixtures("tear_down")
+def test_local_avatar(set_up):
+    app, _ = set_up
+    app.config["FLASKY_AVATAR_MODE"] = "local"
+
+    u = User(email='john@example.com', password='cat')
+    with app.test_request_context('/'):
+        avatar = u.gravatar(size=40)
+
+    assert avatar == '/avatar/d4c74594d841139328695756648b6bd6?s=40'
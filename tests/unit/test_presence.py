@@ -0,0 +1,135 @@
+import datetime
+import time
+import pytest
+from flask import current_app
+from flasky.app import db, last_seen
+from flasky.app.models import User
+from flasky.app.presence import LastSeenBuffer
+
+pytestmark = pytest.mark.usefixtures("set_up_flask_app")
+
+LONG_AGO = datetime.datetime(2020, 1, 1)
+
+
+def add_users_to_db(count):
+    users = [User(email=f"user{ii}@example.com", password="cat", last_seen=LONG_AGO)
+             for ii in range(count)]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def stored_last_seen(user):
+    return db.session.execute(
+        db.select(User.last_seen).where(User.id == user.id)
+    ).scalar_one()
+
+
+def make_buffer(flush_size=2, flush_interval=3600, min_interval=60):
+    buffer = LastSeenBuffer(current_app._get_current_object())
+    buffer.flush_size = flush_size
+    buffer.flush_interval = flush_interval
+    buffer.min_interval = datetime.timedelta(seconds=min_interval)
+    return buffer
+
+
+def wait_for_flush(buffer):
+    """ Waits for the background thread to take the pending pings, then
+        stops it so their write has finished.
+    """
+    deadline = time.monotonic() + 5
+    while buffer.pending() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    buffer.close()
+
+
+def test_pings_are_flushed_in_batches():
+    users = add_users_to_db(3)
+    buffer = make_buffer(flush_size=2)
+
+    buffer.ping(users[0])
+    assert buffer.pending() == 1
+    assert stored_last_seen(users[0]) == LONG_AGO
+
+    buffer.ping(users[1])
+    wait_for_flush(buffer)
+    assert buffer.pending() == 0
+    assert stored_last_seen(users[0]) > LONG_AGO
+    assert stored_last_seen(users[1]) > LONG_AGO
+    assert stored_last_seen(users[2]) == LONG_AGO
+
+
+def test_flush_after_interval():
+    users = add_users_to_db(1)
+    buffer = make_buffer(flush_size=100, flush_interval=0)
+    buffer.ping(users[0])
+    wait_for_flush(buffer)
+    assert buffer.pending() == 0
+    assert stored_last_seen(users[0]) > LONG_AGO
+
+
+def test_min_interval_between_updates():
+    users = add_users_to_db(1)
+    buffer = make_buffer(flush_size=100)
+    buffer.ping(users[0])
+    buffer.ping(users[0])
+    assert buffer.pending() == 1
+    assert buffer.flush() == 1
+
+    buffer.ping(users[0])
+    assert buffer.pending() == 0
+
+
+def test_background_flush_after_quiet_period():
+    users = add_users_to_db(1)
+    buffer = make_buffer(flush_size=100, flush_interval=0.2)
+    buffer.ping(users[0])
+    assert buffer.pending() == 1
+    wait_for_flush(buffer)
+    assert buffer.pending() == 0
+    assert stored_last_seen(users[0]) > LONG_AGO
+
+
+def test_close_writes_pending_pings():
+    users = add_users_to_db(1)
+    buffer = make_buffer(flush_size=100)
+    buffer.ping(users[0])
+    buffer.close()
+    assert buffer.pending() == 0
+    assert stored_last_seen(users[0]) > LONG_AGO
+
+
+def test_failed_flush_keeps_pings(monkeypatch):
+    users = add_users_to_db(2)
+    buffer = make_buffer(flush_size=100)
+    buffer.ping(users[0])
+
+    def fail(pending):
+        raise RuntimeError("database is down")
+    monkeypatch.setattr(buffer, "_write", fail)
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer.pending() == 1
+
+    monkeypatch.undo()
+    buffer.ping(users[1])
+    assert buffer.flush() == 2
+    assert stored_last_seen(users[0]) > LONG_AGO
+
+
+def test_failed_write_doesnt_fail_the_request(monkeypatch):
+    users = add_users_to_db(1)
+    users[0].username = "user0"
+    users[0].confirmed = True
+    db.session.commit()
+    monkeypatch.setattr(last_seen, "flush_size", 1)
+
+    def fail(pending):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(last_seen, "_write", fail)
+    client = current_app.test_client()
+    client.post("/auth/login", data={"email": "user0@example.com", "password": "cat"})
+    assert client.get("/").status_code == 200
+    last_seen.close()
+    assert last_seen.pending() == 1
+    assert stored_last_seen(users[0]) == LONG_AGO
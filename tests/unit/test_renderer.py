@@ -0,0 +1,138 @@
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import pytest
+from flask import current_app
+from flasky.app import db, renderer
+from flasky.app.cache import LRUCache
+from flasky.app.models import Comment, Post
+from flasky.app.renderer import COMMENT_TAGS, POST_TAGS, rerender
+
+pytestmark = pytest.mark.usefixtures("set_up_flask_app")
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert "a" in cache
+    assert "b" not in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_is_bounded_by_size():
+    cache = LRUCache(max_entries=10, max_size=5)
+    cache.set("a", "123")
+    cache.set("b", "456")
+    assert "a" not in cache
+    assert cache.size == 3
+    cache.set("c", "too large")
+    assert "c" not in cache
+
+
+def test_renderer_caches_by_body_and_profile():
+    renderer.cache.clear()
+    stats = renderer.stats()
+    html = renderer.render("*hello*", POST_TAGS)
+    assert renderer.render("*hello*", POST_TAGS) == html
+    renderer.render("*hello*", COMMENT_TAGS)
+
+    new_stats = renderer.stats()
+    assert new_stats["hits"] - stats["hits"] == 1
+    assert new_stats["misses"] - stats["misses"] == 2
+
+
+def test_models_route_through_renderer():
+    renderer.cache.clear()
+    post = Post(body="# title")
+    comment = Comment(body="# title")
+    assert post.body_html == "<h1>title</h1>"
+    # Comments don't allow headers
+    assert comment.body_html == "title"
+    assert renderer.stats()["entries"] == 2
+
+
+@pytest.fixture()
+def deferred():
+    current_app.config["FLASKY_RENDER_DEFERRED"] = True
+    renderer.init_app(current_app)
+    renderer.cache.clear()
+    yield
+    current_app.config["FLASKY_RENDER_DEFERRED"] = False
+    renderer.init_app(current_app)
+
+
+def test_deferred_render_after_commit(deferred):
+    post = Post(body="*<b>new</b>*", author_id=1)
+    db.session.add(post)
+    db.session.flush()
+    assert post.body_html is None
+    with current_app.test_request_context():
+        assert post.to_json()["body_html"] == "*&lt;b&gt;new&lt;/b&gt;*"
+
+    db.session.commit()
+    renderer.join()
+    db.session.refresh(post)
+    assert post.body_html == "<p><em><b>new</b></em></p>"
+    # Cached bodies are still rendered right away
+    assert Comment(body="*<b>new</b>*").body_html is None
+    assert Post(body="*<b>new</b>*").body_html == post.body_html
+
+
+def test_deferred_render_skips_rolled_back_bodies(deferred):
+    db.session.add(Post(body="draft"))
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    renderer.join()
+    assert db.session.execute(db.select(Post)).first() is None
+
+
+def test_deferred_render_survives_savepoint_rollback(deferred):
+    post = Post(body="kept", author_id=1)
+    db.session.add(post)
+    db.session.flush()
+    savepoint = db.session.begin_nested()
+    db.session.add(Post(body="discarded", author_id=1))
+    db.session.flush()
+    savepoint.rollback()
+    db.session.commit()
+    renderer.join()
+    db.session.refresh(post)
+    assert post.body_html == "<p>kept</p>"
+    assert db.session.execute(db.select(Post.body)).scalars().all() == ["kept"]
+
+
+def test_rerender_updates_changed_rows():
+    posts = [Post(body=f"# post {ii}") for ii in range(5)]
+    db.session.add_all(posts)
+    db.session.commit()
+    db.session.execute(db.update(Post).where(Post.id == posts[2].id)
+                       .values(body_html="<h1>old tags</h1>"))
+    db.session.commit()
+
+    assert rerender(Post, workers=2, batch_size=2) == 1
+    db.session.refresh(posts[2])
+    assert posts[2].body_html == "<h1>post 2</h1>"
+
+
+def test_rerender_skips_rows_edited_meanwhile(monkeypatch):
+    post = Post(body="# old title", body_html="stale")
+    db.session.add(post)
+    db.session.commit()
+
+    class EditingExecutor(ThreadPoolExecutor):
+        # Edits the post after the batch was read, before it is written
+        def map(self, *args, **kwargs):
+            db.session.execute(db.update(Post).where(Post.id == post.id)
+                               .values(body="# new title", body_html="<h1>new title</h1>"))
+            db.session.commit()
+            return super().map(*args, **kwargs)
+    # flasky.app.renderer is the renderer instance, not the module
+    monkeypatch.setattr(sys.modules["flasky.app.renderer"], "ProcessPoolExecutor",
+                        EditingExecutor)
+
+    assert rerender(Post, workers=1) == 0
+    db.session.refresh(post)
+    assert post.body_html == "<h1>new title</h1>"
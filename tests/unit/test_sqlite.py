@@ -0,0 +1,27 @@
+from flasky.app import create_app, db
+from flasky.config import config, ProductionConfig
+
+
+def test_production_sqlite_profile(tmp_path):
+    class TunedConfig(ProductionConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + str(tmp_path / "data.sqlite")
+
+    config["tuned"] = TunedConfig
+    try:
+        app = create_app("tuned")
+        with app.app_context():
+            with db.engine.connect() as connection:
+                pragma = lambda name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+                assert pragma("journal_mode") == "wal"
+                assert pragma("synchronous") == 1
+                assert pragma("busy_timeout") == 5000
+                assert pragma("cache_size") == -65536
+            assert db.engine.pool.size() == 5
+            db.engine.dispose()
+    finally:
+        del config["tuned"]
+
+
+def test_no_pragmas_by_default(set_up_flask_app):
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA cache_size").scalar() == -2000
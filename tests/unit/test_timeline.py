@@ -0,0 +1,86 @@
+import pytest
+from flask import current_app
+from flasky.app import db
+from flasky.app.models import Post, Timeline, User
+
+
+@pytest.fixture
+def timelines(set_up_flask_app):
+    current_app.config["FLASKY_MATERIALIZED_TIMELINES"] = True
+
+
+def add_user_to_db(email, username):
+    user = User(email=email, username=username, password="cat")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def add_post_to_db(author, body):
+    post = Post(body=body, author=author)
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def timeline_post_ids(user):
+    return {t.post_id for t in Timeline.query.filter_by(user_id=user.id)}
+
+
+@pytest.mark.usefixtures("timelines")
+def test_new_posts_are_fanned_out_to_followers():
+    john = add_user_to_db("john@example.com", "john")
+    susan = add_user_to_db("susan@example.org", "susan")
+    john.follow(susan)
+    db.session.commit()
+
+    post = add_post_to_db(susan, "hello")
+    assert post.id in timeline_post_ids(john)
+    assert post.id in timeline_post_ids(susan)
+
+
+@pytest.mark.usefixtures("timelines")
+def test_follow_backfills_and_unfollow_prunes_timeline():
+    john = add_user_to_db("john@example.com", "john")
+    susan = add_user_to_db("susan@example.org", "susan")
+    own_post = add_post_to_db(john, "mine")
+    posts = [add_post_to_db(susan, f"post {ii}") for ii in range(3)]
+
+    john.follow(susan)
+    db.session.commit()
+    assert timeline_post_ids(john) == {own_post.id} | {p.id for p in posts}
+
+    john.unfollow(susan)
+    db.session.commit()
+    assert timeline_post_ids(john) == {own_post.id}
+
+
+@pytest.mark.usefixtures("timelines")
+def test_followed_posts_matches_join_query():
+    john = add_user_to_db("john@example.com", "john")
+    susan = add_user_to_db("susan@example.org", "susan")
+    david = add_user_to_db("david@example.net", "david")
+    john.follow(susan)
+    db.session.commit()
+    for author in (john, susan, david, susan):
+        add_post_to_db(author, "body")
+
+    materialized = [p.id for p in john.followed_posts_by_time()]
+    current_app.config["FLASKY_MATERIALIZED_TIMELINES"] = False
+    joined = [p.id for p in john.followed_posts_by_time()]
+    assert materialized == joined
+    assert len(materialized) == 3
+
+
+@pytest.mark.usefixtures("timelines")
+def test_rebuild_timelines():
+    john = add_user_to_db("john@example.com", "john")
+    susan = add_user_to_db("susan@example.org", "susan")
+    john.follow(susan)
+    db.session.commit()
+    post = add_post_to_db(susan, "hello")
+    db.session.execute(db.delete(Timeline))
+    db.session.commit()
+
+    Timeline.rebuild()
+    assert timeline_post_ids(john) == {post.id}